@@ -1,15 +1,32 @@
 import dash
-from dash import dcc, html, Input, Output
+from dash import dcc, html, Input, Output, State
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import datetime
+import os
+
+from catalog import DataCatalog
+from cube import DailyCube, top_n_matrix
+from dateindex import DateIndex
+from downloads import StreamingDownloads, export_options, open_downloads
+from export_cache import EXPORT_CACHE_MB, ExportCache
+from exports import user_export, user_export_columns
+from geo import ZipIndex
+from memo import CallbackCache, ObjectCache, date_range_key
+from paging import paged_table_props, table_page
+from schemas import read_csv_schema
+from sketch import DailySketches
+from snapshot import load_or_build
 
 # ----------------- Load Data -----------------
-# Load appointment data
-appointment = pd.read_csv(
+SOURCE_FILES = [
     r'appointment_list.csv',
-    low_memory=False
-)
+    r'user.csv',
+    r'address.csv',
+    r'address_mapped.csv',
+]
+
 STATUS_MAPPING = {
     'N': 'Not Assigned',
     'D': 'Assigned',
@@ -22,47 +39,133 @@ STATUS_MAPPING = {
     'L': 'Rescheduled',
     'P': 'Paid'
 }
-# Ensure appointment_date is in datetime format
-appointment['appointment_date'] = pd.to_datetime(appointment['cdate'], format='%d-%m-%Y %H:%M', dayfirst=True)
 
-# Convert user_id and g_id to string
-appointment['user_id'] = appointment['user_id'].astype(str)
-appointment['g_id'] = appointment['g_id'].astype(str)
 
-# Fill missing values
-appointment.fillna(0, inplace=True)
+def load_frames():
+    # Every source file is read once and shared by the pages below
+    catalog = DataCatalog(read_csv_schema)
+
+    # Load appointment data (cdate is parsed to datetime while reading)
+    appointment = catalog.table(r'appointment_list.csv')
+    appointment = appointment.rename(columns={'cdate': 'appointment_date'})
+
+    # Fill missing values (categorical columns keep theirs as missing)
+    appointment = appointment.fillna({
+        column: 0 for column in appointment.columns
+        if not isinstance(appointment[column].dtype, pd.CategoricalDtype)
+    })
+
+    # Load user data
+    user = catalog.table(r'user.csv')
+    user['email'] = user.get('email', 'No Email')  # Ensure 'email' column exists
+    user = user[['user_id', 'email']]
+
+    # Load address data
+    address = catalog.project(r'address.csv', ['user_id', 'state'])
+
+    # Merge data
+    appointment = pd.merge(appointment, address, on='user_id', how='left')
+    appointment = pd.merge(appointment, user, on='user_id', how='left')
+
+    # Fill missing states and user emails with placeholders
+    if 'Unknown' not in appointment['state'].cat.categories:
+        appointment['state'] = appointment['state'].cat.add_categories('Unknown')
+    appointment['state'] = appointment['state'].fillna('Unknown')
+    appointment['email'] = appointment['email'].fillna('No Email')
+
+    # Get last appointment date per user (classified after loading, see below)
+    user_last_appointment = appointment.groupby('user_id')['appointment_date'].max().reset_index()
+    user_data = pd.merge(user_last_appointment, user, on='user_id', how='left')
+
+    # Load and prepare address data
+    address_mapped = catalog.table(r'address_mapped.csv')
+    appointment = pd.merge(appointment, address_mapped[['user_id', 'state']], on='user_id', how='left')
+
+    # Rename the 'state_y' column to 'state' and drop the 'state_x' column
+    appointment['state'] = appointment['state_y']
+    appointment.drop(columns=['state_x', 'state_y'], inplace=True)
+
+    # Heatmap data comes from the same catalog reads as the home page
+    merged_data = pd.merge(
+        catalog.project(r'appointment_list.csv', ['user_id', 'g_id', 'total_final', 'cdate'])
+        .rename(columns={'cdate': 'appointment_date'}),
+        catalog.project(r'user.csv', ['user_id', 'zip']),
+        on='user_id', how='left'
+    )
+
+    # Registration dates and consecutive appointment gaps
+    user['registered_date'] = appointment['appointment_date']
+    appointment = appointment.merge(user[['user_id', 'registered_date']], on='user_id', how='left')
 
-# Load user data
-user = pd.read_csv(
-    r'user.csv',
-    low_memory=False
-)
-user['email'] = user.get('email', 'No Email')  # Ensure 'email' column exists
-user['user_id'] = user['user_id'].astype(str)
-user = user[['user_id', 'email']]
+    appointment['days_to_appointment'] = (appointment['appointment_date'] - appointment['registered_date']).dt.days
 
-# Load address data
-address = pd.read_csv(
-    r'address.csv',
-    low_memory=False
-)
-address['user_id'] = address['user_id'].astype(str)
-address = address[['user_id', 'state']]
+    appointment = appointment[appointment['days_to_appointment'].notnull() & (appointment['days_to_appointment'] >= 0)]
+    appointment['appointment_index'] = appointment.groupby('user_id').cumcount() + 1
+    appointment = appointment.sort_values(by=['user_id', 'appointment_date'])
+    appointment['days_between_appointments'] = appointment.groupby('user_id')['appointment_date'].diff().dt.days
+
+    return {
+        'appointment': appointment,
+        'user_data': user_data,
+        'merged_data': merged_data,
+        'address_mapped': address_mapped,
+    }
+
+
+# Bump when load_frames() returns different frames or columns
+FRAMES_LAYOUT = 2
+
+# Reuse the columnar snapshot of the merged frames while the source files are unchanged
+frames, dataset_version = load_or_build(SOURCE_FILES, load_frames, layout=FRAMES_LAYOUT)
+# Date-picker callbacks slice this date-sorted view instead of masking every row
+appointment_dates = DateIndex(frames['appointment'])
+appointment = appointment_dates.frame
+
+# Additive summaries (counts and revenue by g_id/state/status/complaint) are
+# answered from daily prefix sums instead of regrouping the rows
+daily_cube = DailyCube(appointment_dates)
+
+def summarize_g_id(cube):
+    return cube.groupby(['g_id', 'state'], observed=True).agg(
+        Revenue=('revenue', 'sum'),
+        Appointment_Count=('appointments', 'sum')
+    ).reset_index()
+
+def summarize_complaints(cube):
+    complaints = cube[cube['if_complain'] == 'Yes']
+    return complaints.groupby(['g_id', 'state'], observed=True)['appointments'].sum().reset_index(name='Complaints')
 
-# Merge data
-appointment = pd.merge(appointment, address, on='user_id', how='left')
-appointment = pd.merge(appointment, user, on='user_id', how='left')
+# Distinct user counts: 'exact' counts the sliced rows, 'approximate' merges
+# per-day HyperLogLog sketches (about 2% error, cost independent of the range)
+COUNT_MODE = os.getenv('COUNT_MODE', 'exact')
+user_sketches = DailySketches(appointment_dates) if COUNT_MODE == 'approximate' else None
 
-# Fill missing states and user emails with placeholders
-appointment['state'] = appointment['state'].fillna('Unknown')
-appointment['email'] = appointment['email'].fillna('No Email')
+def count_users(filtered_data, start_date, end_date):
+    if user_sketches is not None:
+        return user_sketches.distinct(start_date, end_date)
+    return filtered_data['user_id'].nunique()
+
+def count_users_by_state(filtered_data, start_date, end_date):
+    if user_sketches is not None:
+        user_state_count = user_sketches.distinct_by(start_date, end_date).reset_index()
+    else:
+        user_state_count = filtered_data.groupby('state', observed=True)['user_id'].nunique().reset_index()
+    user_state_count.columns = ['State', 'User Count']
+    return user_state_count
+user_data = frames['user_data']
+merged_data = frames['merged_data']
+# Appointments per day x ZIP x G_ID behind the home heatmap
+heatmap_cube = DailyCube(DateIndex(merged_data), dimensions=['zip', 'g_id'])
+HEATMAP_TOP_N = int(os.getenv('HEATMAP_TOP_N', '50'))
+address_mapped = frames['address_mapped']
+# ZIP coordinates and states for the map, built once
+zip_index = ZipIndex(address_mapped)
 
 # ----------------- User Classification Logic -----------------
 today = datetime.datetime.now()
 
-# Get last appointment date per user
-user_last_appointment = appointment.groupby('user_id')['appointment_date'].max().reset_index()
-user_last_appointment['days_since_last_appointment'] = (today - user_last_appointment['appointment_date']).dt.days
+# Days since last appointment depend on today, so they are never snapshotted
+user_data['days_since_last_appointment'] = (today - user_data['appointment_date']).dt.days
 
 # Add user classification
 def classify_user(days):
@@ -77,13 +180,51 @@ def classify_user(days):
     else:
         return 'Recurring'
 
-user_last_appointment['status'] = user_last_appointment['days_since_last_appointment'].apply(classify_user)
-
-# Merge classification back to user data
-user_data = pd.merge(user_last_appointment, user, on='user_id', how='left')
+user_data['status'] = user_data['days_since_last_appointment'].apply(classify_user)
 
 # ----------------- Dash App Setup -----------------
-app = dash.Dash(__name__, suppress_callback_exceptions=True)
+# The heatmap runs as a background callback through diskcache (see
+# requirements.txt); results are reused per dataset version. If diskcache is
+# missing, it runs in the request.
+try:
+    import diskcache
+    from dash import DiskcacheManager
+    background_callback_manager = DiskcacheManager(
+        diskcache.Cache(os.getenv('CALLBACK_CACHE_DIR', '.callback-cache')),
+        cache_by=[lambda: dataset_version],
+    )
+except ImportError:
+    background_callback_manager = None
+BACKGROUND_CALLBACKS = background_callback_manager is not None
+
+app = dash.Dash(
+    __name__,
+    suppress_callback_exceptions=True,
+    background_callback_manager=background_callback_manager,
+)
+# The home page's callbacks are independent and run concurrently on a
+# threaded server or several workers, e.g. `gunicorn -w 4 app2:server`
+server = app.server
+
+# Results of the date-range and registration callbacks, reused until the
+# data changes; counters at /cache-stats
+callback_cache = CallbackCache(lambda: dataset_version)
+
+@app.server.route('/cache-stats')
+def cache_stats():
+    return callback_cache.stats()
+
+# MapPoints per date range, kept as live objects (see ObjectCache)
+map_cache = ObjectCache(lambda: dataset_version)
+
+# Exports are streamed from /downloads; generated files are kept on disk
+# per dataset version, counters at /export-cache-stats
+export_cache = ExportCache(lambda: dataset_version) if EXPORT_CACHE_MB > 0 else None
+downloads = StreamingDownloads(app.server, cache=export_cache, debug=__name__ == '__main__')
+
+@app.server.route('/export-cache-stats')
+def export_cache_stats():
+    return export_cache.stats() if export_cache is not None else {}
 
 # Include FontAwesome CDN for icons in the head
 app.index_string = '''
@@ -226,21 +367,6 @@ app.layout = html.Div([
 
 
 # ----------------- Home Page -----------------
-# Load and prepare address data
-address_mapped = pd.read_csv(r'address_mapped.csv', low_memory=False)
-address_mapped['user_id'] = address_mapped['user_id'].astype(str)
-appointment = pd.merge(appointment, address_mapped[['user_id', 'state']], on='user_id', how='left')
-
-# Rename the 'state_y' column to 'state' and drop the 'state_x' column
-appointment['state'] = appointment['state_y']
-appointment.drop(columns=['state_x', 'state_y'], inplace=True)
-
-users = pd.read_csv('user.csv', low_memory=False)
-appointments = pd.read_csv('appointment_list.csv', low_memory=False)
-users['user_id'] = users['user_id'].astype(str)
-appointments['user_id'] = appointments['user_id'].astype(str)
-merged_data = pd.merge(appointments, users[['user_id', 'zip']], on='user_id', how='left')
-
 def home_page():
     return html.Div([
         html.H1("Dashboard Overview", style={'textAlign': 'center'}),
@@ -256,35 +382,36 @@ def home_page():
         ),
 
         # KPI Cards
-        html.Div(id='home-kpis'),
+        dcc.Loading(html.Div(id='home-kpis')),
 
         html.Br(),
 
         # Appointment Summary Chart
         html.Div([
             html.H3("Appointment Summary", style={'textAlign': 'center'}),
-            dcc.Graph(id='appointment-summary-chart'),
+            dcc.Loading(dcc.Graph(id='appointment-summary-chart')),
         ]),
 
         html.Br(),
         html.Div([
             html.H3("State-wise Revenue", style={'textAlign': 'center'}),
-            dcc.Graph(id='state-revenue-chart'),
+            dcc.Loading(dcc.Graph(id='state-revenue-chart')),
         ]),
         html.Div([
             html.H3("Complaints by G_ID", style={'textAlign': 'center'}),
-            dcc.Graph(id='complaints-chart'),
+            dcc.Loading(dcc.Graph(id='complaints-chart')),
         ]),
 
         html.Br(),
         # Heatmap
         html.Div([
             html.H3("Appointment Heatmap", style={'textAlign': 'center'}),
-            dcc.Graph(id='appointment-heatmap'),  # Add the heatmap element here
+            dcc.Loading(dcc.Graph(id='appointment-heatmap')),
         ]),
         html.Div([
             html.H3("G_ID Distribution Map", style={'textAlign': 'center'}),
-            html.Div(id='google-map-chart'),  # Placeholder for Google Map chart
+            # The map itself is static; update_zip_layer fills its ZIP layer
+            html.Div(id='google-map-chart', children=zip_map()),
         ]),
 
         html.Br(),
@@ -292,38 +419,43 @@ def home_page():
 
 import dash_leaflet as dl
 import numpy as np
-# Callback to update KPI, Appointment Summary, and Total Final Summary
+
+
+def zip_map():
+    # The ZIP layer is filled by update_zip_layer for the map's viewport
+    return dl.Map(
+        id='zip-map',
+        children=[
+            dl.TileLayer(),  # Base layer for the map
+            # Pre-clustered ZIP points, drawn by assets/map_layers.js
+            dl.GeoJSON(id='zip-layer', pointToLayer={'variable': 'mapLayers.zipPoint'}),
+            dl.LayerGroup(id='zip-popup'),  # Popup of the clicked ZIP
+        ],
+        center=[37.0902, -95.7129],  # Center the map (US coordinates)
+        zoom=4,
+        style={'height': '600px', 'width': '100%'},
+    )
+
+
+# The home page is filled by independent callbacks, so each part renders as
+# soon as it is ready instead of waiting for the slowest one
 @app.callback(
-    [Output('home-kpis', 'children'),
-     Output('appointment-summary-chart', 'figure'),
-     Output('complaints-chart', 'figure'),
-     Output('state-revenue-chart', 'figure'), 
-      Output('appointment-heatmap', 'figure'),
-      Output('google-map-chart', 'children')],
+    Output('home-kpis', 'children'),
     [Input('date-picker-range', 'start_date'),
      Input('date-picker-range', 'end_date')]
 )
-def update_home_content(start_date, end_date):
-    # Convert to datetime
+@callback_cache.memoize('home-kpis', key=date_range_key)
+def update_home_kpis(start_date, end_date):
     start_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
-
-    # Filter appointments based on date range
-    filtered_data = appointment[
-        (appointment['appointment_date'] >= start_date) &
-        (appointment['appointment_date'] <= end_date)
-    ]
+    filtered_data = appointment_dates.between(start_date, end_date)
 
     # Calculate KPIs
     total_appointments = filtered_data['appointment_id'].nunique()
-    total_users = filtered_data['user_id'].nunique()
+    total_users = count_users(filtered_data, start_date, end_date)
     avg_days_to_appointment = (filtered_data['appointment_date'].max() - filtered_data['appointment_date'].min()).days
 
-    filtered_data['total_final'] = pd.to_numeric(filtered_data['total_final'], errors='coerce')
-    print(filtered_data['total_final'].sum())
-    total_revenue = filtered_data['total_final'].sum()
-    print(filtered_data['total_final'].head())
-    print(filtered_data['total_final'].sum())
+    total_revenue = daily_cube.between(start_date, end_date)['revenue'].sum()
 
     # Format total revenue to two decimal places
     total_revenue_formatted = f"{total_revenue:.2f}"
@@ -348,9 +480,26 @@ def update_home_content(start_date, end_date):
         ], className="card"),
     ], style={'display': 'flex', 'justify-content': 'space-around'})
 
+    return kpis
+
+
+@app.callback(
+    [Output('appointment-summary-chart', 'figure'),
+     Output('complaints-chart', 'figure'),
+     Output('state-revenue-chart', 'figure')],
+    [Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date')]
+)
+@callback_cache.memoize('home-charts', key=date_range_key)
+def update_home_charts(start_date, end_date):
+    cube = daily_cube.between(pd.to_datetime(start_date), pd.to_datetime(end_date))
 
     # Appointment Summary Chart
-    appointment_summary = filtered_data['status'].map(STATUS_MAPPING).value_counts().reset_index()
+    appointment_summary = (
+        cube.groupby(cube['status'].map(STATUS_MAPPING), observed=True)['appointments'].sum()
+        .sort_values(ascending=False)
+        .reset_index()
+    )
     appointment_summary.columns = ['Status', 'Count']
 
     chart = px.bar(
@@ -361,13 +510,11 @@ def update_home_content(start_date, end_date):
         labels={'Status': 'Appointment Status', 'Count': 'Number of Appointments'},
         color='Status'
     )
-    filtered_data['if_complain'] = filtered_data['if_complain'].map({'Yes': 1, 'No': 0}).fillna(0)
-
-    # Filter for complaints where 'if_complain' equals 1
+    # Complaints ('if_complain' == 'Yes') per g_id
     complaints_data = (
-        filtered_data[filtered_data['if_complain'] == 1]
-        .groupby('g_id')
-        .size()
+        cube[cube['if_complain'] == 'Yes']
+        .groupby('g_id')['appointments']
+        .sum()
         .reset_index(name='Complaint Count')
     )
 
@@ -395,8 +542,8 @@ def update_home_content(start_date, end_date):
         font=dict(size=12),
     )
 
-    state_revenue = filtered_data.groupby('state').agg(
-        Revenue=('total_final', 'sum')  # Summing up the revenue by state
+    state_revenue = cube.groupby('state', observed=True).agg(
+        Revenue=('revenue', 'sum')  # Summing up the revenue by state
     ).reset_index()
 
     # Create a bar chart for revenue by state
@@ -416,177 +563,95 @@ def update_home_content(start_date, end_date):
         yaxis_title="Total Revenue",
         template="plotly_white"  # Optional: Clean layout
     )
-    
-    # 1. G_ID Summary based on States and Total Final
-    g_id_summary = filtered_data.groupby(['g_id', 'state']).agg(
-        Revenue=('total_final', 'sum'), 
-        Appointment_Count=('appointment_id', 'size')  # Count of appointments for each g_id and state
-    ).reset_index()
-    g_id_summary['Revenue'] = g_id_summary['Revenue'].apply(lambda x: f"{x:.2f}")
-    # Update the DataTable to show Revenue and Appointment Count
-    g_id_summary_table = dash.dash_table.DataTable(
-        id='g-id-summary-table',
-        columns=[
-            {"name": "G_ID", "id": "g_id"},
-            {"name": "State", "id": "state"},
-            {"name": "Revenue", "id": "Revenue"},
-            {"name": "Appointment Count", "id": "Appointment_Count"}
-        ],
-        data=g_id_summary.to_dict('records'),
-        style_table={'overflowX': 'auto'},
-        style_cell={'textAlign': 'left'}
-    )
-
 
-    # 2. G_ID Complaints based on States
-    if 'if_complain' in filtered_data.columns:
-        filtered_data['if_complain'] = filtered_data['if_complain'].map({'Yes': 1, 'No': 0}).fillna(0)
+    return chart, complaints_chart, state_revenue_chart
 
-    if 'if_complain' in filtered_data.columns and not filtered_data.empty:
-        g_id_complaints = filtered_data[filtered_data['if_complain'] == 1].groupby(['g_id', 'state']).size().reset_index(name='Complaints')
-    else:
-        g_id_complaints = pd.DataFrame(columns=['G_ID', 'State', 'Complaints'])
 
+@app.callback(
+    Output('appointment-heatmap', 'figure'),
+    [Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date')],
+    background=BACKGROUND_CALLBACKS,
+)
+@callback_cache.memoize('home-heatmap', key=date_range_key)
+def update_home_heatmap(start_date, end_date):
+    start_date = pd.to_datetime(start_date)
+    end_date = pd.to_datetime(end_date)
 
-    g_id_complaints_table = dash.dash_table.DataTable(
-        id='g-id-complaints-table',
-        columns=[{"name": col, "id": col} for col in g_id_complaints.columns],
-        data=g_id_complaints.to_dict('records'),
-        style_table={'overflowX': 'auto'},
-        style_cell={'textAlign': 'left'},
+    # Appointments per ZIP x G_ID in the range, summed from the daily heatmap
+    # cube; only the busiest HEATMAP_TOP_N ZIPs and G_IDs are drawn
+    g_ids, zips, heatmap_counts = top_n_matrix(
+        heatmap_cube.between(start_date, end_date), 'g_id', 'zip', top_n=HEATMAP_TOP_N
     )
-
-    # 3. Total Count of Users by State
-    user_state_count = filtered_data.groupby('state')['user_id'].nunique().reset_index()
-    user_state_count.columns = ['State', 'User Count']
-    user_state_count_table = dash.dash_table.DataTable(
-        id='user-state-count-table',
-        columns=[{"name": col, "id": col} for col in user_state_count.columns],
-        data=user_state_count.to_dict('records'),
-        style_table={'overflowX': 'auto'},
-        style_cell={'textAlign': 'left'}
+    heatmap = go.Figure(
+        go.Heatmap(
+            z=heatmap_counts, x=zips.astype(str), y=g_ids.astype(str),
+            colorscale='Viridis', colorbar={'title': 'Count'},
+            hovertemplate='ZIP: %{x}<br>G_ID: %{y}<br>Count: %{z}<extra></extra>',
+        ),
+        layout={
+            'title': "Heatmap: G_IDs Close to Users by Zip Code",
+            'xaxis': {'title': 'zip', 'type': 'category'},
+            'yaxis': {'title': 'g_id', 'type': 'category'},
+        },
     )
+    return heatmap
 
-    heatmap_data = merged_data.groupby(['zip', 'g_id']).size().reset_index(name='Count')
-    heatmap = px.density_heatmap(
-        heatmap_data, x='zip', y='g_id', z='Count',
-        title="Heatmap: G_IDs Close to Users by Zip Code",
-        color_continuous_scale="Viridis"
-    )
 
+# ZIP points of a date range, kept across viewport changes
+@map_cache.memoize('map-points', key=date_range_key)
+def map_points(start_date, end_date):
+    filtered_data = appointment_dates.between(pd.to_datetime(start_date), pd.to_datetime(end_date))
+    return zip_index.points(zip_index.zip_users(filtered_data))
 
-    state_names = {
-        "AL": "Alabama",
-        "AR": "Arkansas",
-        "AZ": "Arizona",
-        "NY": "New York",
-        "CA": "California",
-        "CO": "Colorado",
-        "CT": "Connecticut",
-        "DC": "District of Columbia",
-        "DE": "Delaware",
-        "FL": "Florida",
-        "GA": "Georgia",
-        "HI": "Hawaii",
-        "IL": "Illinois",
-        "IN": "Indiana",
-        "KY": "Kentucky",
-        "LA": "Louisiana",
-        "MA": "Massachusetts",
-        "MD": "Maryland",
-        "ME": "Maine",
-        "MI": "Michigan",
-        "MN": "Minnesota",
-        "MO": "Missouri",
-        "MS": "Mississippi",
-        "MT": "Montana",
-        "NC": "North Carolina",
-        "NE": "Nebraska",
-        "NJ": "New Jersey",
-        "NH": "New Hampshire",
-        "NV": "Nevada",
-        "OH": "Ohio",
-        "OK": "Oklahoma",
-        "PA": "Pennsylvania",
-        "SC": "South Carolina",
-        "TX": "Texas",
-        "TN": "Tennessee",
-        "UT": "Utah",
-        "VA": "Virginia",
-        "WA": "Washington",
-        "WY": "Wyoming",
-    }
-    new_filtered_data = pd.merge(filtered_data, address_mapped[['user_id', 'zip']], on='user_id', how='left')
 
-    # Extract ZIP, Latitude, and Longitude
-    zip_coordinates = (
-        address_mapped.groupby('zip')[['latitude', 'longitude']]
-        .mean()
-        .dropna()  # Ensure no missing values
-        .reset_index()
-        .set_index('zip')
-        .to_dict('index')
-    )
-    zip_coordinates = {
-        zip_code: (coords['latitude'], coords['longitude'])
-        for zip_code, coords in zip_coordinates.items()
-    }
+@app.callback(
+    Output('zip-layer', 'data'),
+    [Input('zip-map', 'bounds'),
+     Input('zip-map', 'zoom'),
+     Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date')]
+)
+def update_zip_layer(bounds, zoom, start_date, end_date):
+    # Only the clustered points in view; runs when the map is rendered,
+    # after every pan or zoom and when the date range changes. It stays in
+    # the request rather than running in the background: a background job
+    # runs in another process, where the MapPoints in map_cache don't
+    # survive the job, and its result only arrives on the next poll, which
+    # would make every pan lag.
+    return map_points(start_date, end_date).features(bounds, zoom)
 
-        # Process each ZIP and associated user_ids and g_ids
-    zip_user_g_id_data = new_filtered_data.groupby('zip').agg({
-        'user_id': list,
-        'g_id': list
-    }).reset_index()
-
-    markers = []
-    for zip_code, user_ids, g_ids in zip(zip_user_g_id_data['zip'], zip_user_g_id_data['user_id'], zip_user_g_id_data['g_id']):
-        if zip_code in zip_coordinates:
-            # Remove duplicates and filter out NaN values
-            distinct_user_ids = sorted(set(filter(lambda x: x == x, user_ids)))  # Filter NaN and deduplicate
-            distinct_g_ids = sorted(set(filter(lambda x: x == x, g_ids)))  # Filter NaN and deduplicate
-            user_id_count = len(distinct_user_ids)
-
-            # Get the state abbreviation from the ZIP code (assuming it's in address_mapped)
-            state_abbr = address_mapped[address_mapped['zip'] == zip_code]['state'].iloc[0]  # Extract state abbreviation for the ZIP code
-            state_name = state_names.get(state_abbr, 'Unknown State')  # Map state abbreviation to full state name
-
-            # Prepare display strings for user_ids and g_ids
-            if user_id_count == 0:
-                user_ids_str = "No User_IDs available"
-                g_ids_str = "No G_IDs available"
-            else:
-                user_ids_str = f"{user_id_count} User_ID(s): {', '.join(map(str, distinct_user_ids))}"
-                g_ids_str = f"G_ID(s): {', '.join(map(str, distinct_g_ids))}"
-
-            # Add marker to the list
-            markers.append(
-                dl.Marker(
-                    position=zip_coordinates[zip_code],
-                    children=[
-                        dl.Popup(f"""
-                        ZIP: {zip_code}
-                        State: {state_name} 
-                        User ID Count: {user_id_count}
-                        user ids:{user_ids_str}
-                        g_ids:{g_ids_str}
-                        """)
-                    ],
-                )
-            )
-
-    # Create the map with ZIP code-based markers
-    google_map_chart = dl.Map(
-        children=[
-            dl.TileLayer(),  # Base layer for the map
-            dl.LayerGroup(markers),
-        ],
-        center=[37.0902, -95.7129],  # Center the map (US coordinates)
-        zoom=4,
-        style={'height': '600px', 'width': '100%'},
-    )
 
-    # Return the map along with other KPIs and charts
-    return kpis, chart, complaints_chart, state_revenue_chart, heatmap, google_map_chart
+@app.callback(
+    Output('zip-popup', 'children'),
+    [Input('zip-layer', 'clickData'),
+     Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date')],
+    prevent_initial_call=True
+)
+def show_zip_popup(feature, start_date, end_date):
+    # The clicked ZIP's user_ids and g_ids, looked up only when asked for;
+    # a new date range closes the popup
+    if dash.ctx.triggered_id != 'zip-layer' or not feature or 'zip' not in feature.get('properties', {}):
+        return []
+    text = map_points(start_date, end_date).popup(feature['properties']['zip'])
+    if text is None:
+        return []
+    longitude, latitude = feature['geometry']['coordinates']
+    return [dl.Popup(text, position=[latitude, longitude])]
+
+
+@app.callback(
+    Output('zip-map', 'viewport'),
+    Input('zip-layer', 'clickData'),
+    prevent_initial_call=True
+)
+def zoom_to_cluster(feature):
+    # A clicked cluster zooms the map to its ZIPs; the new viewport then
+    # redraws the layer through update_zip_layer
+    if not feature or not feature.get('properties', {}).get('cluster'):
+        return dash.no_update
+    return {'bounds': feature['properties']['bounds'], 'transition': 'flyToBounds'}
 
 
 # ----------------- Page 2: User Status Analysis -----------------
@@ -614,11 +679,12 @@ def user_status_page():
         # User Status Distribution Chart
         dcc.Graph(id='user-status-chart'),
 
-        # Export Button
+        # Export Button, with its format and columns
+        export_options('export-button', user_export_columns()),
         html.Button('Export User Data', id='export-button', n_clicks=0),
         
-        # Hidden Div to trigger download
-        dcc.Download(id="download-user-data")
+        # URL of the requested export, opened by the browser
+        dcc.Store(id="download-user-data")
     ])
 
 
@@ -652,75 +718,39 @@ def update_user_chart(selected_state, selected_status):
         title="User Distribution by Status",
         labels={'status': 'User Status', 'count': 'User Count'}
     )
-from joblib import Parallel, delayed
-import multiprocessing
+# User statuses are classified relative to the load date
+@downloads.export('user-data', 'detailed_user_data', version=lambda: today.date().isoformat())
+def user_data_export(selected_state, selected_status, columns=None):
+    # Apply filters directly on appointment to reduce data size early
+    filtered_appointments = appointment
+
+    if selected_state:
+        filtered_appointments = filtered_appointments[filtered_appointments['state'] == selected_state]
+
+    if selected_status != 'All':
+        user_ids = user_data[user_data['status'] == selected_status]['user_id']
+        filtered_appointments = filtered_appointments[filtered_appointments['user_id'].isin(user_ids)]
+
+    # One row per user, grouped in a single pass
+    return user_export(filtered_appointments, columns=columns)
+
+
 @app.callback(
     Output("download-user-data", "data"),
     [Input('export-button', 'n_clicks'),
      Input('state-dropdown', 'value'),
-     Input('user-status-dropdown', 'value')]
+     Input('user-status-dropdown', 'value')],
+    [State('export-button-format', 'value'),
+     State('export-button-columns', 'value')]
 )
-def export_user_data(n_clicks, selected_state, selected_status):
+def export_user_data(n_clicks, selected_state, selected_status, export_format, export_columns):
     if n_clicks > 0:
-        # Apply filters directly on appointment to reduce data size early
-        filtered_appointments = appointment.copy()
-
-        if selected_state:
-            filtered_appointments = filtered_appointments[filtered_appointments['state'] == selected_state]
-
-        if selected_status != 'All':
-            user_ids = user_data[user_data['status'] == selected_status]['user_id']
-            filtered_appointments = filtered_appointments[filtered_appointments['user_id'].isin(user_ids)]
-
-        # Group data by user_id
-        grouped_appointments = filtered_appointments.groupby('user_id')
-
-        # Parallel processing for detailed export data
-        # Updated function to process user data
-        def process_user_data(user_id, group):
-            # Count different user statuses
-            status_counts = group['status'].value_counts().to_dict()
-            count_p = status_counts.get('P', 0)  # Potential
-            count_c = status_counts.get('C', 0)  # Confirmed
-            count_l = status_counts.get('L', 0)  # Lost
-            count_all = group['status'].nunique()  # Unique statuses in the group
-
-            # Count unique g_ids
-            unique_g_ids = len(group['g_id'].unique())
-
-            return {
-                'user_id': user_id,
-                'g_ids': ', '.join(group['g_id'].unique().astype(str)),
-                'unique_g_ids': unique_g_ids,  # New column
-                'total_appointments': group['appointment_id'].count(),
-                'appointment_dates': ', '.join(group['appointment_date'].dt.strftime('%Y-%m-%d %H:%M')),
-                'Appointment_status': ', '.join(group['status']),
-                'count_P': count_p,  # New column
-                'count_C': count_c,  # New column
-                'count_L': count_l,  # New column
-                'count_All_Statuses': count_all,  # New column
-                'status': group['status'].iloc[0] if 'status' in group.columns else 'Unknown',
-                'state': group['state'].iloc[0] if 'state' in group.columns else 'Unknown',
-                'total_final_sum': group['total_final'].sum()
-            }
+        # Only a one-time URL goes through the callback; the browser fetches
+        # the file from the streaming route
+        return downloads.url('user-data', selected_state, selected_status, fmt=export_format, columns=export_columns)
 
 
-        # Determine number of available CPU cores
-        num_cores = multiprocessing.cpu_count()
-
-        detailed_data = Parallel(n_jobs=num_cores)(
-            delayed(process_user_data)(user_id, group) for user_id, group in grouped_appointments
-        )
-
-        # Create a DataFrame from parallel results
-        export_df = pd.DataFrame(detailed_data)
-
-        # Create a downloadable CSV
-        return dcc.send_data_frame(
-            export_df.to_csv,
-            filename="detailed_user_data.csv",
-            index=False
-        )
+open_downloads(app, 'download-user-data')
 
 # ----------------- Page 3: Total Final Summary -----------------
 
@@ -743,33 +773,42 @@ def total_final_summary_page():
     ])
 
 
+# The three summary tables for a range, computed once and shared by the
+# table render and the CSV exports
+@callback_cache.memoize('summary-bundle', key=date_range_key)
+def summary_bundle(start_date, end_date):
+    start_date = pd.to_datetime(start_date)
+    end_date = pd.to_datetime(end_date)
+    cube = daily_cube.between(start_date, end_date)
+    return {
+        'g_id_summary': summarize_g_id(cube),
+        'g_id_complaints': summarize_complaints(cube),
+        'user_state_count': count_users_by_state(appointment_dates.between(start_date, end_date), start_date, end_date),
+    }
+
+
 @app.callback(
     [Output('total-final-summary', 'children')],
     [Input('date-picker-range', 'start_date'),
      Input('date-picker-range', 'end_date')]
 )
+@callback_cache.memoize('total-final-summary', key=date_range_key)
 def update_home_content(start_date, end_date):
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
-    filtered_data = appointment[
-        (appointment['appointment_date'] >= start_date) &
-        (appointment['appointment_date'] <= end_date)
-    ]
+    bundle = summary_bundle(start_date, end_date)
 
     total_final_summary_data = []
 
     # G_ID Summary Table
-    g_id_summary = filtered_data.groupby(['g_id', 'state']).agg(
-        Revenue=('total_final', 'sum'),
-        Appointment_Count=('appointment_id', 'size')
-    ).reset_index()
+    g_id_summary = bundle['g_id_summary']
     total_final_summary_data.append(html.Div([
         html.H4("G_ID Summary", style={'textAlign': 'center'}),
+        export_options('export-table-g-id-summary', g_id_summary.columns),
         html.Button('Export G_ID Summary', id='export-table-g-id-summary', n_clicks=0),
-        dcc.Download(id="download-table-g-id-summary"),
+        dcc.Store(id="download-table-g-id-summary"),
         dash.dash_table.DataTable(
+            id='table-g-id-summary',
             columns=[{"name": col, "id": col} for col in g_id_summary.columns],
-            data=g_id_summary.to_dict('records'),
+            **paged_table_props(g_id_summary),
             style_table={'overflowX': 'auto'},
             style_cell={
                 'textAlign': 'center',  # Center align all text
@@ -803,18 +842,16 @@ def update_home_content(start_date, end_date):
     ], style={'marginBottom': '30px'}))
 
     # G_ID Complaints Table
-    filtered_data['if_complain'] = filtered_data['if_complain'].map({'Yes': 1, 'No': 0})
-        
-        # Filter for complaints (where 'if_complain' is 1)
-    complaints_data = filtered_data[filtered_data['if_complain'] == 1]
-    g_id_complaints = complaints_data.groupby(['g_id', 'state']).size().reset_index(name='Complaints')
+    g_id_complaints = bundle['g_id_complaints']
     total_final_summary_data.append(html.Div([
         html.H4("G_ID Complaints", style={'textAlign': 'center'}),
+        export_options('export-table-g-id-complaints', g_id_complaints.columns),
         html.Button('Export G_ID Complaints', id='export-table-g-id-complaints', n_clicks=0),
-        dcc.Download(id="download-table-g-id-complaints"),
+        dcc.Store(id="download-table-g-id-complaints"),
         dash.dash_table.DataTable(
+            id='table-g-id-complaints',
             columns=[{"name": col, "id": col} for col in g_id_complaints.columns],
-            data=g_id_complaints.to_dict('records'),
+            **paged_table_props(g_id_complaints),
             style_table={'overflowX': 'auto'},
             style_cell={
                 'textAlign': 'center',  # Center align all text
@@ -848,15 +885,16 @@ def update_home_content(start_date, end_date):
     ], style={'marginBottom': '30px'}))
 
     # User State Count Table
-    user_state_count = filtered_data.groupby('state')['user_id'].nunique().reset_index()
-    user_state_count.columns = ['State', 'User Count']
+    user_state_count = bundle['user_state_count']
     total_final_summary_data.append(html.Div([
         html.H4("User State Count", style={'textAlign': 'center'}),
+        export_options('export-table-user-state-count', user_state_count.columns),
         html.Button('Export User State Count', id='export-table-user-state-count', n_clicks=0),
-        dcc.Download(id="download-table-user-state-count"),
+        dcc.Store(id="download-table-user-state-count"),
         dash.dash_table.DataTable(
+            id='table-user-state-count',
             columns=[{"name": col, "id": col} for col in user_state_count.columns],
-            data=user_state_count.to_dict('records'),
+            **paged_table_props(user_state_count),
             style_table={'overflowX': 'auto'},
             style_cell={
                 'textAlign': 'center',  # Center align all text
@@ -892,73 +930,68 @@ def update_home_content(start_date, end_date):
     return [html.Div(total_final_summary_data)]
 
 
-@app.callback(
-    Output("download-table-g-id-summary", "data"),
-    [Input("export-table-g-id-summary", "n_clicks"),
-     Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date')]
-)
-def export_table_g_id_summary(n_clicks, start_date, end_date):
-    if n_clicks > 0:
-        start_date = pd.to_datetime(start_date)
-        end_date = pd.to_datetime(end_date)
-        filtered_data = appointment[
-            (appointment['appointment_date'] >= start_date) &
-            (appointment['appointment_date'] <= end_date)
-        ]
-        g_id_summary = filtered_data.groupby(['g_id', 'state']).agg(
-            Revenue=('total_final', 'sum'),
-            Appointment_Count=('appointment_id', 'size')
-        ).reset_index()
-        return dcc.send_data_frame(g_id_summary.to_csv, filename="g_id_summary_table.csv", index=False)
+# Table exports are streamed from /downloads like the user data export, in
+# the format and with the columns picked next to each export button
+TABLE_EXPORTS = {
+    'g-id-summary': 'g_id_summary',
+    'g-id-complaints': 'g_id_complaints',
+    'user-state-count': 'user_state_count',
+}
 
 
-@app.callback(
-    Output("download-table-g-id-complaints", "data"),
-    [Input("export-table-g-id-complaints", "n_clicks"),
-     Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date')]
-)
-def export_table_g_id_complaints(n_clicks, start_date, end_date):
-    if n_clicks > 0:
-        start_date = pd.to_datetime(start_date)
-        end_date = pd.to_datetime(end_date)
-        
-        # Filter appointments within the date range
-        filtered_data = appointment[
-            (appointment['appointment_date'] >= start_date) &
-            (appointment['appointment_date'] <= end_date)
-        ]
-        
-        # Map 'Yes' to 1 and 'No' to 0 in the 'if_complain' column
-        filtered_data['if_complain'] = filtered_data['if_complain'].map({'Yes': 1, 'No': 0})
-        
-        # Filter for complaints (where 'if_complain' is 1)
-        complaints_data = filtered_data[filtered_data['if_complain'] == 1]
-        
-        # Group by 'g_id' and 'state', then count complaints
-        g_id_complaints = complaints_data.groupby(['g_id', 'state']).size().reset_index(name='Complaints')
-        
-        return dcc.send_data_frame(g_id_complaints.to_csv, filename="g_id_complaints_table.csv", index=False)
+def register_table_export(name, frame_name):
+    @downloads.export(name, f'{frame_name}_table')
+    def table_export(start_date, end_date, columns=None):
+        return summary_bundle(start_date, end_date)[frame_name]
 
+    @app.callback(
+        Output(f'download-table-{name}', 'data'),
+        [Input(f'export-table-{name}', 'n_clicks'),
+         Input('date-picker-range', 'start_date'),
+         Input('date-picker-range', 'end_date')],
+        [State(f'export-table-{name}-format', 'value'),
+         State(f'export-table-{name}-columns', 'value')]
+    )
+    def export_table(n_clicks, start_date, end_date, export_format, export_columns):
+        if n_clicks > 0:
+            return downloads.url(name, start_date, end_date, fmt=export_format, columns=export_columns)
 
-@app.callback(
-    Output("download-table-user-state-count", "data"),
-    [Input("export-table-user-state-count", "n_clicks"),
-     Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date')]
-)
-def export_table_user_state_count(n_clicks, start_date, end_date):
-    if n_clicks > 0:
-        start_date = pd.to_datetime(start_date)
-        end_date = pd.to_datetime(end_date)
-        filtered_data = appointment[
-            (appointment['appointment_date'] >= start_date) &
-            (appointment['appointment_date'] <= end_date)
-        ]
-        user_state_count = filtered_data.groupby('state')['user_id'].nunique().reset_index()
-        user_state_count.columns = ['State', 'User Count']
-        return dcc.send_data_frame(user_state_count.to_csv, filename="user_state_count_table.csv", index=False)
+
+for name, frame_name in TABLE_EXPORTS.items():
+    register_table_export(name, frame_name)
+
+open_downloads(app, *[f'download-table-{name}' for name in TABLE_EXPORTS])
+
+
+
+# The summary tables hold one page at a time; paging, sorting and filtering
+# are applied here to the range's cached summary frames
+PAGED_TABLES = {
+    'table-g-id-summary': 'g_id_summary',
+    'table-g-id-complaints': 'g_id_complaints',
+    'table-user-state-count': 'user_state_count',
+}
+
+def register_table_paging(table_id, name):
+    @app.callback(
+        [Output(table_id, 'data'),
+         Output(table_id, 'page_count')],
+        [Input(table_id, 'page_current'),
+         Input(table_id, 'page_size'),
+         Input(table_id, 'sort_by'),
+         Input(table_id, 'filter_query')],
+        [State('date-picker-range', 'start_date'),
+         State('date-picker-range', 'end_date')],
+        # The summary callback renders the first page itself
+        prevent_initial_call=True
+    )
+    def update_table_page(page_current, page_size, sort_by, filter_query, start_date, end_date):
+        frame = summary_bundle(start_date, end_date)[name]
+        data, page_count = table_page(frame, page_current, page_size, sort_by, filter_query)
+        return data, page_count
+
+for table_id, name in PAGED_TABLES.items():
+    register_table_paging(table_id, name)
 
 
 # ----------------- Page 4: Appointment Analysis -----------------
@@ -987,11 +1020,9 @@ def appointment_analysis_page():
     Input('appointment-date-picker', 'start_date'),
     Input('appointment-date-picker', 'end_date')
 )
+@callback_cache.memoize('appointment-analysis', key=date_range_key)
 def update_appointment_graphs(start_date, end_date):
-    filtered_data = appointment[
-        (appointment['appointment_date'] >= pd.to_datetime(start_date)) &
-        (appointment['appointment_date'] <= pd.to_datetime(end_date))
-    ]
+    filtered_data = appointment_dates.between(pd.to_datetime(start_date), pd.to_datetime(end_date))
 
     histogram_fig = px.histogram(
         filtered_data,
@@ -1017,15 +1048,6 @@ def update_appointment_graphs(start_date, end_date):
 
 
 # ----------------- Page 4: Registration Analysis -----------------
-user['registered_date'] = pd.to_datetime(appointment['cdate'], format='%d-%m-%Y %H:%M', dayfirst=True)
-appointment = appointment.merge(user[['user_id', 'registered_date']], on='user_id', how='left')
-
-appointment['days_to_appointment'] = (appointment['appointment_date'] - appointment['registered_date']).dt.days
-
-appointment = appointment[appointment['days_to_appointment'].notnull() & (appointment['days_to_appointment'] >= 0)]
-appointment['appointment_index'] = appointment.groupby('user_id').cumcount() + 1
-appointment = appointment.sort_values(by=['user_id', 'appointment_date'])
-appointment['days_between_appointments'] = appointment.groupby('user_id')['appointment_date'].diff().dt.days
 appointment_gap_summary = (
     appointment
     .groupby('appointment_index')
@@ -1073,6 +1095,7 @@ def registrations():
     ],
     [Input('quarter-dropdown', 'value')]
 )
+@callback_cache.memoize('registration')
 def update_all_figures(selected_quarter):
     # Filter data based on selected quarter
     filtered_data = (
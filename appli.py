@@ -4,30 +4,24 @@ from dash import dcc, html, Input, Output, State
 import plotly.express as px
 import datetime
 
-# ----------------- Load Data -----------------
-
-# Load appointment data
-appointment = pd.read_csv(
-    r'appointment_list.csv',
-    low_memory=False
-)
+from downloads import StreamingDownloads, export_options, open_downloads
+from exports import user_export, user_export_columns
+from schemas import read_csv_schema
 
-# Ensure appointment_date is in datetime format
-appointment['appointment_date'] = pd.to_datetime(appointment['cdate'])
+# ----------------- Load Data -----------------
 
-# Convert user_id and g_id to string
-appointment['user_id'] = appointment['user_id'].astype(str)
-appointment['g_id'] = appointment['g_id'].astype(str)
+# Load appointment data (cdate is parsed to datetime while reading)
+appointment = read_csv_schema(r'appointment_list.csv')
+appointment = appointment.rename(columns={'cdate': 'appointment_date'})
 
-# Fill missing values
-appointment.fillna(0, inplace=True)
+# Fill missing values (categorical columns keep theirs as missing)
+appointment = appointment.fillna({
+    column: 0 for column in appointment.columns
+    if not isinstance(appointment[column].dtype, pd.CategoricalDtype)
+})
 
 # Load user data
-user = pd.read_csv(
-    r'user.csv',
-    low_memory=False
-)
-user['user_id'] = user['user_id'].astype(str)
+user = read_csv_schema(r'user.csv')
 
 # Ensure expected columns exist
 if 'email' not in user.columns:
@@ -36,18 +30,15 @@ if 'email' not in user.columns:
 user = user[['user_id', 'email']]
 
 # Load address data
-address = pd.read_csv(
-    r'address.csv',
-    low_memory=False
-)
-address['user_id'] = address['user_id'].astype(str)
-address = address[['user_id', 'state']]
+address = read_csv_schema(r'address.csv')
 
 # Merge data
 appointment = pd.merge(appointment, address, on='user_id', how='left')
 appointment = pd.merge(appointment, user, on='user_id', how='left')
 
 # Fill missing states and user emails with placeholders
+if 'Unknown' not in appointment['state'].cat.categories:
+    appointment['state'] = appointment['state'].cat.add_categories('Unknown')
 appointment['state'] = appointment['state'].fillna('Unknown')
 appointment['email'] = appointment['email'].fillna('No Email')
 
@@ -80,6 +71,9 @@ user_data = pd.merge(user_last_appointment, user, on='user_id', how='left')
 # ----------------- Dash App Setup -----------------
 app = dash.Dash(__name__)
 
+# Exports are streamed from /downloads
+downloads = StreamingDownloads(app.server, debug=__name__ == '__main__')
+
 # Get unique states for dropdown
 unique_states = appointment['state'].unique()
 state_options = [{'label': state, 'value': state} for state in unique_states]
@@ -115,8 +109,10 @@ app.layout = html.Div([
 
     dcc.Graph(id='user-status-chart'),
 
+    export_options('export-button', user_export_columns(first_columns=('user_status', 'state'), status_counts=False)),
     html.Button("Export  Users", id='export-button', n_clicks=0),
-    dcc.Download(id="download-user-data")
+    # URL of the requested export, opened by the browser
+    dcc.Store(id="download-user-data")
 ])
 
 # ----------------- Callbacks -----------------
@@ -193,96 +189,41 @@ def update_user_chart(selected_state, selected_status):
     )
 
 
-# Export Top Users
-@app.callback(
-    Output("download-user-data", "data"),
-    [Input('export-button', 'n_clicks'),
-     Input('state-dropdown', 'value'),
-     Input('user-status-dropdown', 'value')]
-)
-def export_user_data(n_clicks, selected_state, selected_status):
-    if n_clicks > 0:
-        # Apply filters directly on appointment to reduce data size early
-        filtered_appointments = appointment.copy()
-        
-        if selected_state:
-            filtered_appointments = filtered_appointments[filtered_appointments['state'] == selected_state]
-        
-        if selected_status != 'All':
-            user_ids = user_data[user_data['user_status'] == selected_status]['user_id']
-            filtered_appointments = filtered_appointments[filtered_appointments['user_id'].isin(user_ids)]
-        
-        # Group data by user_id
-        grouped_appointments = filtered_appointments.groupby('user_id')
-        
-        # Parallel processing for detailed export data
-        def process_user_data(user_id, group):
-            return {
-                'user_id': user_id,
-                'g_ids': ', '.join(group['g_id'].unique().astype(str)),
-                'total_appointments': group['appointment_id'].count(),
-                'appointment_dates': ', '.join(group['appointment_date'].dt.strftime('%Y-%m-%d %H:%M')),
-                'Appointment_status': ', '.join(group['status']),
-                'user_status': group['user_status'].iloc[0] if 'user_status' in group.columns else 'Unknown',
-                'state': group['state'].iloc[0] if 'state' in group.columns else 'Unknown',
-                'total_final_sum': group['total_final'].sum()
-        }
-
-from joblib import Parallel, delayed
-import multiprocessing
-
 # ----------------- Optimized Export Callback -----------------
 
-# Export Detailed User Data with Parallel Processing
+# Export Detailed User Data
+@downloads.export('user-data', 'detailed_user_data')
+def user_data_export(selected_state, selected_status, columns=None):
+    # Apply filters directly on appointment to reduce data size early
+    filtered_appointments = appointment
+
+    if selected_state:
+        filtered_appointments = filtered_appointments[filtered_appointments['state'] == selected_state]
+
+    if selected_status != 'All':
+        user_ids = user_data[user_data['user_status'] == selected_status]['user_id']
+        filtered_appointments = filtered_appointments[filtered_appointments['user_id'].isin(user_ids)]
+
+    # One row per user, grouped in a single pass
+    return user_export(filtered_appointments, first_columns=('user_status', 'state'), status_counts=False, columns=columns)
+
+
 @app.callback(
     Output("download-user-data", "data"),
     [Input('export-button', 'n_clicks'),
      Input('state-dropdown', 'value'),
-     Input('user-status-dropdown', 'value')]
+     Input('user-status-dropdown', 'value')],
+    [State('export-button-format', 'value'),
+     State('export-button-columns', 'value')]
 )
-def export_user_data(n_clicks, selected_state, selected_status):
+def export_user_data(n_clicks, selected_state, selected_status, export_format, export_columns):
     if n_clicks > 0:
-        # Apply filters directly on appointment to reduce data size early
-        filtered_appointments = appointment.copy()
-        
-        if selected_state:
-            filtered_appointments = filtered_appointments[filtered_appointments['state'] == selected_state]
-        
-        if selected_status != 'All':
-            user_ids = user_data[user_data['user_status'] == selected_status]['user_id']
-            filtered_appointments = filtered_appointments[filtered_appointments['user_id'].isin(user_ids)]
-        
-        # Group data by user_id
-        grouped_appointments = filtered_appointments.groupby('user_id')
-        
-        # Parallel processing for detailed export data
-        def process_user_data(user_id, group):
-            return {
-                'user_id': user_id,
-                'g_ids': ', '.join(group['g_id'].unique().astype(str)),
-                'total_appointments': group['appointment_id'].count(),
-                'appointment_dates': ', '.join(group['appointment_date'].dt.strftime('%Y-%m-%d %H:%M')),
-                'Appointment_status': ', '.join(group['status']),
-                'user_status': group['user_status'].iloc[0] if 'user_status' in group.columns else 'Unknown',
-                'state': group['state'].iloc[0] if 'state' in group.columns else 'Unknown',
-                'total_final_sum': group['total_final'].sum()
-            }
-        
-        # Determine number of available CPU cores
-        num_cores = multiprocessing.cpu_count()
-        
-        detailed_data = Parallel(n_jobs=num_cores)(
-            delayed(process_user_data)(user_id, group) for user_id, group in grouped_appointments
-        )
-        
-        # Create a DataFrame from parallel results
-        export_df = pd.DataFrame(detailed_data)
-        
-        return dcc.send_data_frame(
-            export_df.to_csv,
-            filename="detailed_user_data.csv",
-            index=False
-        )
+        # Only a one-time URL goes through the callback; the browser fetches
+        # the file from the streaming route
+        return downloads.url('user-data', selected_state, selected_status, fmt=export_format, columns=export_columns)
+
+
+open_downloads(app, 'download-user-data')
 
 if __name__ == '__main__':
     app.run_server(port='8051',debug=True)
@@ -0,0 +1,22 @@
+// Point styles for the ZIP map's GeoJSON layer, referenced from Python as
+// {'variable': 'mapLayers.<name>'}. The features come pre-clustered from
+// geo.MapPoints.features, so the layer's own clustering is off.
+window.mapLayers = Object.assign({}, window.mapLayers, {
+    // A cluster is drawn as a count bubble with the markercluster styles that
+    // dash-leaflet ships; a single ZIP keeps the default pin
+    zipPoint: function (feature, latlng) {
+        var properties = feature.properties;
+        if (!properties.cluster) {
+            return L.marker(latlng);
+        }
+        var count = properties.point_count;
+        var size = count < 100 ? 'small' : count < 1000 ? 'medium' : 'large';
+        return L.marker(latlng, {
+            icon: L.divIcon({
+                html: '<div><span>' + count + '</span></div>',
+                className: 'marker-cluster marker-cluster-' + size,
+                iconSize: L.point(40, 40),
+            }),
+        });
+    },
+});
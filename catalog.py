@@ -0,0 +1,69 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# ----------------- Data Catalog -----------------
+# Loads every source once and shares it between the pages that need it.
+#
+# Frames are handed out as shallow copies: callers may add or replace
+# columns on their copy, but must not modify values in place (no
+# inplace=True, no .loc writes) because the underlying arrays are shared.
+#
+# Each source is loaded at most once; a caller asking for a source that is
+# still loading waits for that source only.
+class DataCatalog:
+    def __init__(self, loader):
+        self._loader = loader
+        self._tables = {}
+        self._projections = {}
+        self._lock = threading.Lock()
+
+    def _run(self, name, future):
+        try:
+            future.set_result(self._loader(name))
+        except BaseException as error:
+            future.set_exception(error)
+
+    def _load(self, name):
+        with self._lock:
+            future = self._tables.get(name)
+            owner = future is None
+            if owner:
+                future = self._tables[name] = Future()
+        if owner:
+            self._run(name, future)
+        return future.result()
+
+    def prefetch(self, names):
+        # Start loading the sources in parallel; table()/project() then only
+        # block until the source they ask for has arrived
+        with self._lock:
+            pending = [name for name in names if name not in self._tables]
+            for name in pending:
+                self._tables[name] = Future()
+        if pending:
+            executor = ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix='catalog')
+            for name in pending:
+                executor.submit(self._run, name, self._tables[name])
+            executor.shutdown(wait=False)
+
+    def table(self, name):
+        return self._load(name).copy(deep=False)
+
+    def project(self, name, columns):
+        # Column projections are cached, so every consumer asking for the
+        # same columns shares one frame
+        key = (name, tuple(columns))
+        with self._lock:
+            projection = self._projections.get(key)
+        if projection is None:
+            projection = self._load(name)[list(columns)]
+            with self._lock:
+                projection = self._projections.setdefault(key, projection)
+        return projection.copy(deep=False)
+
+    def clear(self):
+        # Drop the cached sources once the derived frames are built
+        with self._lock:
+            self._tables.clear()
+            self._projections.clear()
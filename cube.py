@@ -0,0 +1,181 @@
+import copy
+
+import numpy as np
+import pandas as pd
+
+from dateindex import day_number
+
+DIMENSIONS = ['g_id', 'state', 'status', 'if_complain']
+
+
+def _cents(values):
+    # Revenue is summed in integer cents so prefix differences stay exact
+    return np.round(pd.to_numeric(values, errors='coerce').fillna(0).to_numpy(dtype='float64') * 100).astype('int64')
+
+
+def _daily(rows, dimensions, column):
+    # Appointments and revenue per (cell, day) of the dated rows, ordered by
+    # cell, then day
+    dated = rows[rows[column].notna()]
+    return (
+        dated[dimensions]
+        .assign(day=day_number(dated[column]), appointments=1, revenue=_cents(dated['total_final']))
+        .groupby(dimensions + ['day'], observed=True, dropna=False, sort=True)
+        .agg(appointments=('appointments', 'sum'), revenue=('revenue', 'sum'))
+        .reset_index()
+    )
+
+
+# ----------------- Daily Cube -----------------
+# Appointment count and revenue per (day, g_id, state, status, if_complain),
+# built once from a DateIndex. Rows are ordered by cell, then day, with
+# running totals alongside, so the sum of any whole-day range for every cell
+# is two binary searches and a subtraction. Partial days at either end of a
+# range are grouped from the DateIndex slice.
+class DailyCube:
+    def __init__(self, date_index, dimensions=DIMENSIONS):
+        self.date_index = date_index
+        self.dimensions = list(dimensions)
+        daily = _daily(date_index.frame, self.dimensions, date_index.column)
+        cell = daily.groupby(self.dimensions, observed=True, dropna=False, sort=False).ngroup().to_numpy()
+
+        self.cells = daily.loc[~pd.Series(cell).duplicated().to_numpy(), self.dimensions].reset_index(drop=True)
+        self.first_day = int(daily['day'].min()) if len(daily) else 0
+        self.span = int(daily['day'].max()) - self.first_day + 2 if len(daily) else 1
+        self._cell_ids = np.arange(len(self.cells), dtype='int64')
+        self._keys = cell * self.span + (daily['day'].to_numpy() - self.first_day)
+        self._appointments = np.concatenate([[0], np.cumsum(daily['appointments'].to_numpy())])
+        self._revenue = np.concatenate([[0], np.cumsum(daily['revenue'].to_numpy())])
+
+    def extended(self, date_index, added):
+        # The cube of date_index, whose frame is this cube's rows plus the
+        # rows `added` (see DateIndex.extended). Only the added rows are
+        # grouped: their day totals are added to the matching entries or
+        # inserted as new ones, cells are renumbered from the cell table
+        # alone, and the running totals are recomputed from the first entry
+        # touched onwards.
+        frame = date_index.frame
+        daily = _daily(added, self.dimensions, date_index.column)
+        if not len(self._keys):
+            return DailyCube(date_index, self.dimensions)
+
+        cube = copy.copy(self)
+        cube.date_index = date_index
+        # Cells take the frame's categories, which the new rows may have widened
+        cells = self.cells.astype({
+            column: frame[column].dtype for column in self.dimensions
+            if isinstance(frame[column].dtype, pd.CategoricalDtype)
+        })
+        if not len(daily):
+            cube.cells = cells
+            return cube
+
+        # Cell numbers in the order a fresh build would give them
+        known = len(cells)
+        both = pd.concat([cells, daily[self.dimensions].astype(cells.dtypes.to_dict())], ignore_index=True)
+        numbers = both.groupby(self.dimensions, observed=True, dropna=False, sort=True).ngroup().to_numpy()
+        _, first_rows = np.unique(numbers, return_index=True)
+        cube.cells = both.iloc[first_rows].reset_index(drop=True)
+        cube._cell_ids = np.arange(len(cube.cells), dtype='int64')
+
+        days = daily['day'].to_numpy()
+        cube.first_day = min(self.first_day, int(days.min()))
+        cube.span = max(self.first_day + self.span - 2, int(days.max())) - cube.first_day + 2
+
+        cell, offset = np.divmod(self._keys, self.span)
+        keys = numbers[:known][cell] * cube.span + (offset + self.first_day - cube.first_day)
+        appointments = np.diff(self._appointments)
+        revenue = np.diff(self._revenue)
+        in_order = bool(np.all(keys[1:] > keys[:-1]))
+        if not in_order:
+            # Re-sorted categories renumbered the existing cells out of order
+            order = np.argsort(keys, kind='stable')
+            keys, appointments, revenue = keys[order], appointments[order], revenue[order]
+
+        new_keys = numbers[known:] * cube.span + (days - cube.first_day)
+        order = np.argsort(new_keys, kind='stable')
+        new_keys = new_keys[order]
+        new_appointments = daily['appointments'].to_numpy()[order]
+        new_revenue = daily['revenue'].to_numpy()[order]
+
+        at = np.searchsorted(keys, new_keys)
+        hit = at < len(keys)
+        hit[hit] = keys[at[hit]] == new_keys[hit]
+        appointments[at[hit]] += new_appointments[hit]
+        revenue[at[hit]] += new_revenue[hit]
+        cube._keys = np.insert(keys, at[~hit], new_keys[~hit])
+        appointments = np.insert(appointments, at[~hit], new_appointments[~hit])
+        revenue = np.insert(revenue, at[~hit], new_revenue[~hit])
+
+        # Entries before the first touched one kept their place and totals
+        start = int(at.min()) if in_order else 0
+        cube._appointments = np.concatenate([self._appointments[:start + 1], self._appointments[start] + np.cumsum(appointments[start:])])
+        cube._revenue = np.concatenate([self._revenue[:start + 1], self._revenue[start] + np.cumsum(revenue[start:])])
+        return cube
+
+    def _whole_days(self, first_day, end_day):
+        # Per-cell totals for days first_day <= day < end_day
+        first = np.clip(first_day - self.first_day, 0, self.span - 1)
+        end = np.clip(end_day - self.first_day, 0, self.span - 1)
+        lo = np.searchsorted(self._keys, self._cell_ids * self.span + first, side='left')
+        hi = np.searchsorted(self._keys, self._cell_ids * self.span + end, side='left')
+        return self.cells.assign(
+            appointments=self._appointments[hi] - self._appointments[lo],
+            revenue=self._revenue[hi] - self._revenue[lo],
+        )
+
+    def _rows(self, rows):
+        return (
+            rows[self.dimensions]
+            .assign(appointments=1, revenue=_cents(rows['total_final']))
+            .groupby(self.dimensions, observed=True, dropna=False, sort=False)
+            .agg(appointments=('appointments', 'sum'), revenue=('revenue', 'sum'))
+            .reset_index()
+        )
+
+    def between(self, start_date, end_date):
+        # Same cells and totals as grouping the rows with
+        # start_date <= date <= end_date, without touching those rows
+        first_day, end_day, edges = self.date_index.split_days(start_date, end_date)
+        parts = []
+        if first_day < end_day:
+            whole_days = self._whole_days(first_day, end_day)
+            parts.append(whole_days[whole_days['appointments'] > 0])
+        parts += [self._rows(rows) for rows in edges if len(rows)]
+        if not parts:
+            parts = [self._rows(edges[0])]
+
+        if len(parts) > 1:
+            # Edge-day rows land in the same cells as the whole days
+            cube = (
+                pd.concat(parts, ignore_index=True)
+                .groupby(self.dimensions, observed=True, dropna=False, sort=False).sum()
+            )
+        else:
+            cube = parts[0]
+        cube = cube.reset_index(drop=len(parts) == 1)
+        cube = cube[cube['appointments'] > 0].reset_index(drop=True)
+        cube['revenue'] = cube['revenue'] / 100
+        return cube
+
+
+def top_n_matrix(counts, rows, columns, value='appointments', top_n=None):
+    # Dense rows x columns matrix of `value` over the top_n row and column
+    # labels by total (all of them when top_n is falsy), labels sorted
+    counts = counts.dropna(subset=[rows, columns])
+
+    def top_labels(label):
+        totals = counts.groupby(label, observed=True)[value].sum()
+        if top_n:
+            totals = totals.nlargest(top_n)
+        return pd.Index(totals.index).sort_values()
+
+    row_labels, column_labels = top_labels(rows), top_labels(columns)
+    kept = counts[counts[rows].isin(row_labels) & counts[columns].isin(column_labels)]
+    matrix = np.zeros((len(row_labels), len(column_labels)), dtype=counts[value].dtype)
+    np.add.at(
+        matrix,
+        (row_labels.get_indexer(kept[rows]), column_labels.get_indexer(kept[columns])),
+        kept[value].to_numpy(),
+    )
+    return row_labels, column_labels, matrix
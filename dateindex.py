@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+
+def day_number(dates):
+    # Days since the epoch (UTC days for tz-aware dates)
+    dates = pd.DatetimeIndex(dates)
+    if dates.tz is not None:
+        dates = dates.tz_convert(None)
+    return dates.to_numpy().astype('datetime64[D]').astype('int64')
+
+
+# ----------------- Date Index -----------------
+# Keeps a frame sorted by one datetime column so a date range is found with
+# two binary searches. between() returns a positional slice that shares the
+# frame's arrays: O(log n) to locate, no per-row mask and no column copies.
+#
+# As with the catalog, callers may add or replace columns on the slice but
+# must not modify values in place.
+class DateIndex:
+    def __init__(self, frame, column='appointment_date'):
+        # Stable sort: rows on the same date keep their order, and an already
+        # (nearly) sorted frame is re-sorted in close to linear time
+        self.frame = frame.sort_values(column, kind='stable', na_position='last', ignore_index=True)
+        self.column = column
+        # Rows without a date never match a range, so they sit past the
+        # searchable part
+        self._dates = self.frame[column].iloc[:self.frame[column].notna().sum()]
+
+    def extended(self, frame):
+        # DateIndex of `frame`: this index's frame (same rows, same order,
+        # same dates) with more rows appended. Only the appended rows are
+        # sorted; they are merged in after existing rows on the same date,
+        # which is where a stable sort of the whole frame puts them.
+        existing = len(self.frame)
+        added = frame[self.column].iloc[existing:].reset_index(drop=True)
+        added = added.sort_values(kind='stable', na_position='last')
+        dated = int(added.notna().sum())
+        offsets = added.index.to_numpy()
+
+        # Dated rows (old and new interleaved), then the old and the new
+        # undated ones
+        searchable = len(self._dates)
+        order = np.empty(len(frame), dtype='int64')
+        head = order[:searchable + dated]
+        is_added = np.zeros(len(head), dtype=bool)
+        is_added[self._dates.searchsorted(added.iloc[:dated], side='right') + np.arange(dated)] = True
+        head[is_added] = existing + offsets[:dated]
+        head[~is_added] = np.arange(searchable)
+        order[searchable + dated:existing + dated] = np.arange(searchable, existing)
+        order[existing + dated:] = existing + offsets[dated:]
+
+        index = DateIndex.__new__(DateIndex)
+        index.frame = frame.take(order)
+        index.frame.index = pd.RangeIndex(len(order))
+        index.column = self.column
+        index._dates = index.frame[self.column].iloc[:searchable + dated]
+        return index
+
+    def position(self, date, side='left'):
+        # First row dated on/after `date` ('left') or after it ('right')
+        return self._dates.searchsorted(date, side=side)
+
+    def bounds(self, start_date, end_date):
+        # Positions of the rows with start_date <= date <= end_date
+        start = self.position(start_date, 'left')
+        end = self.position(end_date, 'right')
+        return start, max(start, end)
+
+    def between(self, start_date, end_date):
+        start, end = self.bounds(start_date, end_date)
+        return self.frame.iloc[start:end]
+
+    def split_days(self, start_date, end_date):
+        # For per-day aggregates: the whole days first_day <= day < end_day
+        # inside the range, plus slices with the rows on the partial days at
+        # either end. A range within one day is all edge rows.
+        first_day = day_number([start_date.ceil('D')])[0]
+        end_day = day_number([end_date.floor('D')])[0]
+        start, end = self.bounds(start_date, end_date)
+        if first_day >= end_day:
+            return first_day, first_day, [self.frame.iloc[start:end]]
+
+        tz = self.frame[self.column].dt.tz
+        left, right = (
+            self.position(pd.Timestamp(day, unit='D').tz_localize(tz))
+            for day in (first_day, end_day)
+        )
+        return first_day, end_day, [self.frame.iloc[start:left], self.frame.iloc[right:end]]
@@ -1,15 +1,33 @@
 import dash
-from dash import dcc, html, Input, Output
+from dash import dcc, html, Input, Output, State
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import datetime
 import psycopg2
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from datetime import datetime
 import datetime
 import pandas as pd
 pd.set_option('future.no_silent_downcasting', True)
 import pytz  # For timezone handling
+import threading
+import hashlib
+import json
+from collections import namedtuple
+
+from catalog import DataCatalog
+from cube import DailyCube, top_n_matrix
+from dateindex import DateIndex
+from downloads import StreamingDownloads, export_options, open_downloads
+from export_cache import EXPORT_CACHE_MB, ExportCache
+from exports import user_export, user_export_columns
+from geo import ZipIndex
+from memo import CallbackCache, ObjectCache, date_range_key
+from paging import paged_table_props, table_page
+from db_queries import TABLE_ARROW_TYPES, TABLE_DTYPES, copy_query, projected_query, range_aggregates, range_heatmap, rows_after_query, table_column_types
+from refresh import WatermarkRefresher, append_rows
+from sketch import DailySketches
 
 # Create 'today' as tz-aware
 today = pd.Timestamp.now(tz='UTC')
@@ -34,14 +52,64 @@ db_url = f"postgresql://{DB_CONFIG['USER']}:{DB_CONFIG['PASSWORD']}@{DB_CONFIG['
 engine = create_engine(db_url)
 
 # Fetch data from database
-def fetch_data(query):
+def fetch_data(query, **kwargs):
     with engine.connect() as conn:
-        return pd.read_sql(query, conn)
+        return pd.read_sql(query, conn, **kwargs)
+
+# 'copy' streams the zip_* tables with COPY ... TO STDOUT into typed Arrow
+# columns; 'sql' fetches them row by row through pd.read_sql
+FETCH_MODE = os.getenv('FETCH_MODE', 'copy')
+
+# Date-range summaries: 'memory' filters the loaded frames on each
+# date-picker change; 'sql' pushes the date predicate and grouping down to
+# Postgres and only fetches the aggregated rows, so the in-memory date
+# indexes, cubes and sketches are never built.
+QUERY_MODE = os.getenv('QUERY_MODE', 'memory')
+
+def read_table(table, query, params=None):
+    if FETCH_MODE == 'copy':
+        return copy_query(engine, query, TABLE_ARROW_TYPES[table], params)
+    return fetch_data(
+        text(query),
+        params=params,
+        dtype=TABLE_DTYPES.get(table),
+        parse_dates={'appointment_date': {'utc': True}},
+    )
+
+# Digest of each table's rows as loaded, behind the dataset key (data_key)
+table_digests = {}
+
+def table_digest(rows):
+    # Sum of the row hashes, wrapping at 64 bits: independent of row order,
+    # so rows added later can be folded in, and any inserted, updated or
+    # deleted row changes it
+    return int(pd.util.hash_pandas_object(rows, index=False).to_numpy().sum(dtype='uint64'))
+
+def load_table(table):
+    # Only the columns the dashboard uses, cast and parsed by Postgres
+    with engine.connect() as conn:
+        query = projected_query(conn, table)
+    rows = read_table(table, query)
+    table_digests[table] = table_digest(rows)
+    return rows
+
+def load_new_appointments(watermark):
+    with engine.connect() as conn:
+        query = rows_after_query(conn, 'zip_appointment', 'appointment_id')
+    return read_table('zip_appointment', query, {'watermark': int(watermark)})
+
+# Every zip_* table is fetched once and shared by the pages below. The four
+# fetches run concurrently on the engine's connection pool, and each step
+# below waits only for the tables it reads.
+catalog = DataCatalog(load_table)
+catalog.prefetch(['zip_appointment', 'zip_user', 'zip_address', 'zip_address_mapped'])
 
 # ----------------- Load Data -----------------
 # Load appointment data
 
-appointment = fetch_data("SELECT * FROM zip_appointment")
+appointment = catalog.table('zip_appointment')
+# Highest appointment_id loaded; the refresher only fetches rows past it
+appointment_watermark = appointment['appointment_id'].max() if len(appointment) else 0
 
 STATUS_MAPPING = {
     'N': 'Not Assigned',
@@ -55,35 +123,29 @@ STATUS_MAPPING = {
     'L': 'Rescheduled',
     'P': 'Paid'
 }
-# Ensure appointment_date is in datetime format
-appointment['appointment_date'] = pd.to_datetime(appointment['cdate'], format='%d-%m-%Y %H:%M', dayfirst=True)
-
-# Convert user_id and g_id to string
-appointment['user_id'] = appointment['user_id'].astype(str)
-appointment['g_id'] = appointment['g_id'].astype(str)
-
+# appointment_date arrives as a UTC timestamp and user_id/g_id as text
 
-appointment = appointment.copy() 
-appointment = appointment.fillna({col: 0 for col in appointment.columns})
+appointment = appointment.fillna({
+    col: 0 for col in appointment.columns
+    if not isinstance(appointment[col].dtype, pd.CategoricalDtype)
+})
 
 
 # Load user data
-user = fetch_data("SELECT * FROM zip_user")
+user = catalog.table('zip_user')
 user['email'] = user.get('email', 'No Email')  # Ensure 'email' column exists
-user['user_id'] = user['user_id'].astype(str)
 user = user[['user_id', 'email']]
 
 # Load address data
-address = fetch_data("SELECT * FROM zip_address")
-
-address['user_id'] = address['user_id'].astype(str)
-address = address[['user_id', 'state']]
+address = catalog.table('zip_address')
 
 # Merge data
 appointment = pd.merge(appointment, address, on='user_id', how='left')
 appointment = pd.merge(appointment, user, on='user_id', how='left')
 
 # Fill missing states and user emails with placeholders
+if 'Unknown' not in appointment['state'].cat.categories:
+    appointment['state'] = appointment['state'].cat.add_categories('Unknown')
 appointment['state'] = appointment['state'].fillna('Unknown')
 appointment['email'] = appointment['email'].fillna('No Email')
 
@@ -118,7 +180,48 @@ user_last_appointment['status'] = user_last_appointment['days_since_last_appoint
 user_data = pd.merge(user_last_appointment, user, on='user_id', how='left')
 
 # ----------------- Dash App Setup -----------------
-app = dash.Dash(__name__, suppress_callback_exceptions=True)
+# The heatmap runs as a background callback through diskcache (see
+# requirements.txt); results are reused per dataset key. If diskcache is
+# missing, it runs in the request.
+try:
+    import diskcache
+    from dash import DiskcacheManager
+    background_callback_manager = DiskcacheManager(
+        diskcache.Cache(os.getenv('CALLBACK_CACHE_DIR', '.callback-cache')),
+        cache_by=[lambda: data_state.key],
+    )
+except ImportError:
+    background_callback_manager = None
+BACKGROUND_CALLBACKS = background_callback_manager is not None
+
+app = dash.Dash(
+    __name__,
+    suppress_callback_exceptions=True,
+    background_callback_manager=background_callback_manager,
+)
+# The home page's callbacks are independent and run concurrently on a
+# threaded server or several workers; see create_server() for the latter
+server = app.server
+
+# Results of the date-range and registration callbacks, reused until the
+# data changes; counters at /cache-stats
+callback_cache = CallbackCache(lambda: data_state.version)
+
+@app.server.route('/cache-stats')
+def cache_stats():
+    return callback_cache.stats()
+
+# MapPoints per date range, kept as live objects (see ObjectCache)
+map_cache = ObjectCache(lambda: data_state.version)
+
+# Exports are streamed from /downloads; generated files are kept on disk
+# per dataset key, counters at /export-cache-stats
+export_cache = ExportCache(lambda: data_state.key) if EXPORT_CACHE_MB > 0 else None
+downloads = StreamingDownloads(app.server, cache=export_cache, debug=__name__ == '__main__')
+
+@app.server.route('/export-cache-stats')
+def export_cache_stats():
+    return export_cache.stats() if export_cache is not None else {}
 
 # Include FontAwesome CDN for icons in the head
 app.index_string = '''
@@ -262,22 +365,113 @@ app.layout = html.Div([
 
 # ----------------- Home Page -----------------
 # Load and prepare address data
-address_mapped = fetch_data("SELECT * FROM zip_address_mapped")
-
-address_mapped['user_id'] = address_mapped['user_id'].astype(str)
+address_mapped = catalog.table('zip_address_mapped')
+# ZIP coordinates and states for the map, built once
+zip_index = ZipIndex(address_mapped)
 appointment = pd.merge(appointment, address_mapped[['user_id', 'state']], on='user_id', how='left')
 
 # Rename the 'state_y' column to 'state' and drop the 'state_x' column
 appointment['state'] = appointment['state_y']
 appointment.drop(columns=['state_x', 'state_y'], inplace=True)
 
-users = fetch_data("SELECT * FROM zip_user")
+# Heatmap data reuses the tables already fetched for the home page
+users = catalog.project('zip_user', ['user_id', 'zip'])
+if QUERY_MODE == 'sql':
+    # The heatmap is aggregated by Postgres
+    merged_data = heatmap_dates = heatmap_cube = None
+else:
+    appointments = catalog.project('zip_appointment', ['user_id', 'g_id', 'total_final', 'appointment_date'])
+    merged_data = pd.merge(appointments, users, on='user_id', how='left')
+    # Appointments per day x ZIP x G_ID behind the home heatmap
+    heatmap_dates = DateIndex(merged_data)
+    merged_data = heatmap_dates.frame
+    heatmap_cube = DailyCube(heatmap_dates, dimensions=['zip', 'g_id'])
+HEATMAP_TOP_N = int(os.getenv('HEATMAP_TOP_N', '50'))
+
+# The derived frames are built, so the raw tables can go
+catalog.clear()
+
+# ----------------- Date-Range Summaries -----------------
+# Distinct user counts in 'memory' mode: 'exact' counts the sliced rows,
+# 'approximate' merges per-day HyperLogLog sketches (about 2% error, cost
+# independent of the range)
+COUNT_MODE = os.getenv('COUNT_MODE', 'exact')
+
+def to_utc(date):
+    return pd.to_datetime(date).tz_localize('UTC')
+
+def fetch_range_aggregates(start_date, end_date):
+    with engine.connect() as conn:
+        column_types = table_column_types(conn, 'zip_appointment')
+        return range_aggregates(conn, column_types, start_date, end_date)
+
+def fetch_range_heatmap(start_date, end_date):
+    with engine.connect() as conn:
+        column_types = table_column_types(conn, 'zip_appointment')
+        return range_heatmap(conn, column_types, start_date, end_date)
+
+def compute_range_aggregates(state, start_date, end_date):
+    filtered_data = state.appointment_dates.between(start_date, end_date)
+    daily = state.daily_cube.between(start_date, end_date)
+    cube = (
+        daily
+        .assign(complaint=daily['if_complain'].eq('Yes').astype(int))
+        .groupby(['g_id', 'state', 'status', 'complaint'], observed=True, dropna=False)
+        .agg(appointments=('appointments', 'sum'), revenue=('revenue', 'sum'))
+        .reset_index()
+    )
+    if state.user_sketches is not None:
+        total_users = state.user_sketches.distinct(start_date, end_date)
+        state_users = state.user_sketches.distinct_by(start_date, end_date).reset_index(name='users')
+    else:
+        total_users = filtered_data['user_id'].nunique()
+        state_users = filtered_data.groupby('state', observed=True)['user_id'].nunique().reset_index(name='users')
+    totals = {
+        'total_appointments': filtered_data['appointment_id'].nunique(),
+        'total_users': total_users,
+        'first_date': filtered_data['appointment_date'].min(),
+        'last_date': filtered_data['appointment_date'].max(),
+    }
 
-appointments = fetch_data("SELECT * FROM zip_appointment")
+    # (zip, user_id, g_id) for the map markers
+    zip_users = zip_index.zip_users(filtered_data)
+    return {'cube': cube, 'totals': totals, 'state_users': state_users, 'zip_users': zip_users}
 
-users['user_id'] = users['user_id'].astype(str)
-appointments['user_id'] = appointments['user_id'].astype(str)
-merged_data = pd.merge(appointments, users[['user_id', 'zip']], on='user_id', how='left')
+# The per-range summary bundle: computed once per range and shared by the
+# home page, the summary tables and the CSV exports
+@callback_cache.memoize('summary-bundle', key=date_range_key)
+def summarize_range(start_date, end_date):
+    if QUERY_MODE == 'sql':
+        aggregates = fetch_range_aggregates(start_date, end_date)
+    else:
+        aggregates = compute_range_aggregates(data_state, start_date, end_date)
+
+    # Everything below only regroups the small aggregated cube
+    cube = aggregates['cube']
+    complaints = cube[cube['complaint'] == 1]
+    with_state = cube.dropna(subset=['state'])
+
+    status_counts = (
+        cube.groupby(cube['status'].map(STATUS_MAPPING), observed=True)['appointments'].sum()
+        .sort_values(ascending=False)
+        .reset_index()
+    )
+    status_counts.columns = ['Status', 'Count']
+
+    return {
+        **aggregates['totals'],
+        'total_revenue': cube['revenue'].sum(),
+        'status_counts': status_counts[status_counts['Count'] > 0],
+        'complaint_counts': complaints.groupby('g_id')['appointments'].sum().reset_index(name='Complaint Count'),
+        'state_revenue': with_state.groupby('state', observed=True)['revenue'].sum().reset_index(name='Revenue'),
+        'g_id_summary': with_state.groupby(['g_id', 'state'], observed=True).agg(
+            Revenue=('revenue', 'sum'),
+            Appointment_Count=('appointments', 'sum')
+        ).reset_index(),
+        'g_id_complaints': complaints.dropna(subset=['state']).groupby(['g_id', 'state'], observed=True)['appointments'].sum().reset_index(name='Complaints'),
+        'user_state_count': aggregates['state_users'].rename(columns={'state': 'State', 'users': 'User Count'}),
+        'zip_users': aggregates['zip_users'],
+    }
 
 def home_page():
     return html.Div([
@@ -287,42 +481,43 @@ def home_page():
         html.Label("Filter Appointments by Date:"),
         dcc.DatePickerRange(
             id='date-picker-range',
-            start_date=appointment['appointment_date'].min().date(),
-            end_date=appointment['appointment_date'].max().date(),
+            start_date=data_state.appointment['appointment_date'].min().date(),
+            end_date=data_state.appointment['appointment_date'].max().date(),
             display_format='YYYY-MM-DD',
             style={'margin-bottom': '20px'}
         ),
 
         # KPI Cards
-        html.Div(id='home-kpis'),
+        dcc.Loading(html.Div(id='home-kpis')),
 
         html.Br(),
 
         # Appointment Summary Chart
         html.Div([
             html.H3("Appointment Summary", style={'textAlign': 'center'}),
-            dcc.Graph(id='appointment-summary-chart'),
+            dcc.Loading(dcc.Graph(id='appointment-summary-chart')),
         ]),
 
         html.Br(),
         html.Div([
             html.H3("State-wise Revenue", style={'textAlign': 'center'}),
-            dcc.Graph(id='state-revenue-chart'),
+            dcc.Loading(dcc.Graph(id='state-revenue-chart')),
         ]),
         html.Div([
             html.H3("Complaints by G_ID", style={'textAlign': 'center'}),
-            dcc.Graph(id='complaints-chart'),
+            dcc.Loading(dcc.Graph(id='complaints-chart')),
         ]),
 
         html.Br(),
         # Heatmap
         html.Div([
             html.H3("Appointment Heatmap", style={'textAlign': 'center'}),
-            dcc.Graph(id='appointment-heatmap'),  # Add the heatmap element here
+            dcc.Loading(dcc.Graph(id='appointment-heatmap')),
         ]),
         html.Div([
             html.H3("G_ID Distribution Map", style={'textAlign': 'center'}),
-            html.Div(id='google-map-chart'),  # Placeholder for Google Map chart
+            # The map itself is static; update_zip_layer fills its ZIP layer
+            html.Div(id='google-map-chart', children=zip_map()),
         ]),
 
         html.Br(),
@@ -330,38 +525,40 @@ def home_page():
 
 import dash_leaflet as dl
 import numpy as np
-# Callback to update KPI, Appointment Summary, and Total Final Summary
+
+def zip_map():
+    # The ZIP layer is filled by update_zip_layer for the map's viewport
+    return dl.Map(
+        id='zip-map',
+        children=[
+            dl.TileLayer(),  # Base layer for the map
+            # Pre-clustered ZIP points, drawn by assets/map_layers.js
+            dl.GeoJSON(id='zip-layer', pointToLayer={'variable': 'mapLayers.zipPoint'}),
+            dl.LayerGroup(id='zip-popup'),  # Popup of the clicked ZIP
+        ],
+        center=[37.0902, -95.7129],  # Center the map (US coordinates)
+        zoom=4,
+        style={'height': '600px', 'width': '100%'},
+    )
+
+# The home page is filled by independent callbacks, so each part renders as
+# soon as it is ready instead of waiting for the slowest one. They share
+# summarize_range, which is computed once per range.
 @app.callback(
-    [Output('home-kpis', 'children'),
-     Output('appointment-summary-chart', 'figure'),
-     Output('complaints-chart', 'figure'),
-     Output('state-revenue-chart', 'figure'), 
-      Output('appointment-heatmap', 'figure'),
-      Output('google-map-chart', 'children')],
+    Output('home-kpis', 'children'),
     [Input('date-picker-range', 'start_date'),
      Input('date-picker-range', 'end_date')]
 )
-def update_home_content(start_date, end_date):
-    # Convert to datetime
-    start_date = pd.to_datetime(start_date).tz_localize('UTC')
-    end_date = pd.to_datetime(end_date).tz_localize('UTC')
-
-    # Filter appointments based on date range
-    filtered_data = appointment[
-        (appointment['appointment_date'] >= start_date) &
-        (appointment['appointment_date'] <= end_date)
-    ]
+@callback_cache.memoize('home-kpis', key=date_range_key)
+def update_home_kpis(start_date, end_date):
+    summary = summarize_range(to_utc(start_date), to_utc(end_date))
 
     # Calculate KPIs
-    total_appointments = filtered_data['appointment_id'].nunique()
-    total_users = filtered_data['user_id'].nunique()
-    avg_days_to_appointment = (filtered_data['appointment_date'].max() - filtered_data['appointment_date'].min()).days
+    total_appointments = summary['total_appointments']
+    total_users = summary['total_users']
+    avg_days_to_appointment = (summary['last_date'] - summary['first_date']).days
 
-    filtered_data['total_final'] = pd.to_numeric(filtered_data['total_final'], errors='coerce')
-    print(filtered_data['total_final'].sum())
-    total_revenue = filtered_data['total_final'].sum()
-    print(filtered_data['total_final'].head())
-    print(filtered_data['total_final'].sum())
+    total_revenue = summary['total_revenue']
 
     # Format total revenue to two decimal places
     total_revenue_formatted = f"{total_revenue:.2f}"
@@ -386,10 +583,21 @@ def update_home_content(start_date, end_date):
         ], className="card"),
     ], style={'display': 'flex', 'justify-content': 'space-around'})
 
+    return kpis
+
+@app.callback(
+    [Output('appointment-summary-chart', 'figure'),
+     Output('complaints-chart', 'figure'),
+     Output('state-revenue-chart', 'figure')],
+    [Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date')]
+)
+@callback_cache.memoize('home-charts', key=date_range_key)
+def update_home_charts(start_date, end_date):
+    summary = summarize_range(to_utc(start_date), to_utc(end_date))
 
     # Appointment Summary Chart
-    appointment_summary = filtered_data['status'].map(STATUS_MAPPING).value_counts().reset_index()
-    appointment_summary.columns = ['Status', 'Count']
+    appointment_summary = summary['status_counts']
 
     chart = px.bar(
         appointment_summary,
@@ -399,15 +607,9 @@ def update_home_content(start_date, end_date):
         labels={'Status': 'Appointment Status', 'Count': 'Number of Appointments'},
         color='Status'
     )
-    filtered_data['if_complain'] = filtered_data['if_complain'].map({'Yes': 1, 'No': 0}).fillna(0)
 
-    # Filter for complaints where 'if_complain' equals 1
-    complaints_data = (
-        filtered_data[filtered_data['if_complain'] == 1]
-        .groupby('g_id')
-        .size()
-        .reset_index(name='Complaint Count')
-    )
+    # Complaints per g_id (if_complain == 'Yes')
+    complaints_data = summary['complaint_counts']
 
     # Ensure there is data for the chart
     if complaints_data.empty:
@@ -433,9 +635,7 @@ def update_home_content(start_date, end_date):
         font=dict(size=12),
     )
 
-    state_revenue = filtered_data.groupby('state').agg(
-        Revenue=('total_final', 'sum')  # Summing up the revenue by state
-    ).reset_index()
+    state_revenue = summary['state_revenue']
 
     # Create a bar chart for revenue by state
     state_revenue_chart = px.bar(
@@ -454,178 +654,92 @@ def update_home_content(start_date, end_date):
         yaxis_title="Total Revenue",
         template="plotly_white"  # Optional: Clean layout
     )
-    
-    # 1. G_ID Summary based on States and Total Final
-    g_id_summary = filtered_data.groupby(['g_id', 'state']).agg(
-        Revenue=('total_final', 'sum'), 
-        Appointment_Count=('appointment_id', 'size')  # Count of appointments for each g_id and state
-    ).reset_index()
-    g_id_summary['Revenue'] = g_id_summary['Revenue'].apply(lambda x: f"{x:.2f}")
-    # Update the DataTable to show Revenue and Appointment Count
-    g_id_summary_table = dash.dash_table.DataTable(
-        id='g-id-summary-table',
-        columns=[
-            {"name": "G_ID", "id": "g_id"},
-            {"name": "State", "id": "state"},
-            {"name": "Revenue", "id": "Revenue"},
-            {"name": "Appointment Count", "id": "Appointment_Count"}
-        ],
-        data=g_id_summary.to_dict('records'),
-        style_table={'overflowX': 'auto'},
-        style_cell={'textAlign': 'left'}
-    )
 
+    return chart, complaints_chart, state_revenue_chart
 
-    # 2. G_ID Complaints based on States
-    if 'if_complain' in filtered_data.columns:
-        filtered_data['if_complain'] = filtered_data['if_complain'].map({'Yes': 1, 'No': 0}).fillna(0)
-
-    if 'if_complain' in filtered_data.columns and not filtered_data.empty:
-        g_id_complaints = filtered_data[filtered_data['if_complain'] == 1].groupby(['g_id', 'state']).size().reset_index(name='Complaints')
+@app.callback(
+    Output('appointment-heatmap', 'figure'),
+    [Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date')],
+    background=BACKGROUND_CALLBACKS,
+)
+@callback_cache.memoize('home-heatmap', key=date_range_key)
+def update_home_heatmap(start_date, end_date):
+    start_date = to_utc(start_date)
+    end_date = to_utc(end_date)
+
+    # Appointments per ZIP x G_ID in the range, summed from the daily heatmap
+    # cube (or grouped by Postgres); only the busiest HEATMAP_TOP_N ZIPs and
+    # G_IDs are drawn
+    if QUERY_MODE == 'sql':
+        counts = fetch_range_heatmap(start_date, end_date)
     else:
-        g_id_complaints = pd.DataFrame(columns=['G_ID', 'State', 'Complaints'])
-
-
-    g_id_complaints_table = dash.dash_table.DataTable(
-        id='g-id-complaints-table',
-        columns=[{"name": col, "id": col} for col in g_id_complaints.columns],
-        data=g_id_complaints.to_dict('records'),
-        style_table={'overflowX': 'auto'},
-        style_cell={'textAlign': 'left'},
-    )
-
-    # 3. Total Count of Users by State
-    user_state_count = filtered_data.groupby('state')['user_id'].nunique().reset_index()
-    user_state_count.columns = ['State', 'User Count']
-    user_state_count_table = dash.dash_table.DataTable(
-        id='user-state-count-table',
-        columns=[{"name": col, "id": col} for col in user_state_count.columns],
-        data=user_state_count.to_dict('records'),
-        style_table={'overflowX': 'auto'},
-        style_cell={'textAlign': 'left'}
-    )
-
-    heatmap_data = merged_data.groupby(['zip', 'g_id']).size().reset_index(name='Count')
-    heatmap = px.density_heatmap(
-        heatmap_data, x='zip', y='g_id', z='Count',
-        title="Heatmap: G_IDs Close to Users by Zip Code",
-        color_continuous_scale="Viridis"
-    )
-
-
-    state_names = {
-        "AL": "Alabama",
-        "AR": "Arkansas",
-        "AZ": "Arizona",
-        "NY": "New York",
-        "CA": "California",
-        "CO": "Colorado",
-        "CT": "Connecticut",
-        "DC": "District of Columbia",
-        "DE": "Delaware",
-        "FL": "Florida",
-        "GA": "Georgia",
-        "HI": "Hawaii",
-        "IL": "Illinois",
-        "IN": "Indiana",
-        "KY": "Kentucky",
-        "LA": "Louisiana",
-        "MA": "Massachusetts",
-        "MD": "Maryland",
-        "ME": "Maine",
-        "MI": "Michigan",
-        "MN": "Minnesota",
-        "MO": "Missouri",
-        "MS": "Mississippi",
-        "MT": "Montana",
-        "NC": "North Carolina",
-        "NE": "Nebraska",
-        "NJ": "New Jersey",
-        "NH": "New Hampshire",
-        "NV": "Nevada",
-        "OH": "Ohio",
-        "OK": "Oklahoma",
-        "PA": "Pennsylvania",
-        "SC": "South Carolina",
-        "TX": "Texas",
-        "TN": "Tennessee",
-        "UT": "Utah",
-        "VA": "Virginia",
-        "WA": "Washington",
-        "WY": "Wyoming",
-    }
-    new_filtered_data = pd.merge(filtered_data, address_mapped[['user_id', 'zip']], on='user_id', how='left')
-
-    # Extract ZIP, Latitude, and Longitude
-    zip_coordinates = (
-        address_mapped.groupby('zip')[['latitude', 'longitude']]
-        .mean()
-        .dropna()  # Ensure no missing values
-        .reset_index()
-        .set_index('zip')
-        .to_dict('index')
+        counts = data_state.heatmap_cube.between(start_date, end_date)
+    g_ids, zips, heatmap_counts = top_n_matrix(counts, 'g_id', 'zip', top_n=HEATMAP_TOP_N)
+    heatmap = go.Figure(
+        go.Heatmap(
+            z=heatmap_counts, x=zips.astype(str), y=g_ids.astype(str),
+            colorscale='Viridis', colorbar={'title': 'Count'},
+            hovertemplate='ZIP: %{x}<br>G_ID: %{y}<br>Count: %{z}<extra></extra>',
+        ),
+        layout={
+            'title': "Heatmap: G_IDs Close to Users by Zip Code",
+            'xaxis': {'title': 'zip', 'type': 'category'},
+            'yaxis': {'title': 'g_id', 'type': 'category'},
+        },
     )
-    zip_coordinates = {
-        zip_code: (coords['latitude'], coords['longitude'])
-        for zip_code, coords in zip_coordinates.items()
-    }
+    return heatmap
 
-        # Process each ZIP and associated user_ids and g_ids
-    zip_user_g_id_data = new_filtered_data.groupby('zip').agg({
-        'user_id': list,
-        'g_id': list
-    }).reset_index()
-
-    markers = []
-    for zip_code, user_ids, g_ids in zip(zip_user_g_id_data['zip'], zip_user_g_id_data['user_id'], zip_user_g_id_data['g_id']):
-        if zip_code in zip_coordinates:
-            # Remove duplicates and filter out NaN values
-            distinct_user_ids = sorted(set(filter(lambda x: x == x, user_ids)))  # Filter NaN and deduplicate
-            distinct_g_ids = sorted(set(filter(lambda x: x == x, g_ids)))  # Filter NaN and deduplicate
-            user_id_count = len(distinct_user_ids)
-
-            # Get the state abbreviation from the ZIP code (assuming it's in address_mapped)
-            state_abbr = address_mapped[address_mapped['zip'] == zip_code]['state'].iloc[0]  # Extract state abbreviation for the ZIP code
-            state_name = state_names.get(state_abbr, 'Unknown State')  # Map state abbreviation to full state name
-
-            # Prepare display strings for user_ids and g_ids
-            if user_id_count == 0:
-                user_ids_str = "No User_IDs available"
-                g_ids_str = "No G_IDs available"
-            else:
-                user_ids_str = f"{user_id_count} User_ID(s): {', '.join(map(str, distinct_user_ids))}"
-                g_ids_str = f"G_ID(s): {', '.join(map(str, distinct_g_ids))}"
-
-            # Add marker to the list
-            markers.append(
-                dl.Marker(
-                    position=zip_coordinates[zip_code],
-                    children=[
-                        dl.Popup(f"""
-                        ZIP: {zip_code}
-                        State: {state_name} 
-                        User ID Count: {user_id_count}
-                        user ids:{user_ids_str}
-                        g_ids:{g_ids_str}
-                        """)
-                    ],
-                )
-            )
+# ZIP points of a date range, kept across viewport changes
+@map_cache.memoize('map-points', key=date_range_key)
+def map_points(start_date, end_date):
+    return zip_index.points(summarize_range(start_date, end_date)['zip_users'])
 
-    # Create the map with ZIP code-based markers
-    google_map_chart = dl.Map(
-        children=[
-            dl.TileLayer(),  # Base layer for the map
-            dl.LayerGroup(markers),
-        ],
-        center=[37.0902, -95.7129],  # Center the map (US coordinates)
-        zoom=4,
-        style={'height': '600px', 'width': '100%'},
-    )
+@app.callback(
+    Output('zip-layer', 'data'),
+    [Input('zip-map', 'bounds'),
+     Input('zip-map', 'zoom'),
+     Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date')]
+)
+def update_zip_layer(bounds, zoom, start_date, end_date):
+    # Only the clustered points in view; runs when the map is rendered,
+    # after every pan or zoom and when the date range changes. It stays in
+    # the request rather than running in the background: a background job
+    # runs in another process, where the MapPoints in map_cache don't
+    # survive the job, and its result only arrives on the next poll, which
+    # would make every pan lag.
+    return map_points(to_utc(start_date), to_utc(end_date)).features(bounds, zoom)
 
-    # Return the map along with other KPIs and charts
-    return kpis, chart, complaints_chart, state_revenue_chart, heatmap, google_map_chart
+@app.callback(
+    Output('zip-popup', 'children'),
+    [Input('zip-layer', 'clickData'),
+     Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date')],
+    prevent_initial_call=True
+)
+def show_zip_popup(feature, start_date, end_date):
+    # The clicked ZIP's user_ids and g_ids, looked up only when asked for;
+    # a new date range closes the popup
+    if dash.ctx.triggered_id != 'zip-layer' or not feature or 'zip' not in feature.get('properties', {}):
+        return []
+    text = map_points(to_utc(start_date), to_utc(end_date)).popup(feature['properties']['zip'])
+    if text is None:
+        return []
+    longitude, latitude = feature['geometry']['coordinates']
+    return [dl.Popup(text, position=[latitude, longitude])]
 
+@app.callback(
+    Output('zip-map', 'viewport'),
+    Input('zip-layer', 'clickData'),
+    prevent_initial_call=True
+)
+def zoom_to_cluster(feature):
+    # A clicked cluster zooms the map to its ZIPs; the new viewport then
+    # redraws the layer through update_zip_layer
+    if not feature or not feature.get('properties', {}).get('cluster'):
+        return dash.no_update
+    return {'bounds': feature['properties']['bounds'], 'transition': 'flyToBounds'}
 
 # ----------------- Page 2: User Status Analysis -----------------
 def user_status_page():
@@ -636,7 +750,7 @@ def user_status_page():
         html.Label("Filter by State:"),
         dcc.Dropdown(
             id='state-dropdown',
-            options=[{'label': state, 'value': state} for state in appointment['state'].unique()],
+            options=[{'label': state, 'value': state} for state in data_state.appointment['state'].unique()],
             value=None,
             placeholder="Select a state"
         ),
@@ -652,11 +766,12 @@ def user_status_page():
         # User Status Distribution Chart
         dcc.Graph(id='user-status-chart'),
 
-        # Export Button
+        # Export Button, with its format and columns
+        export_options('export-button', user_export_columns()),
         html.Button('Export User Data', id='export-button', n_clicks=0),
         
-        # Hidden Div to trigger download
-        dcc.Download(id="download-user-data")
+        # URL of the requested export, opened by the browser
+        dcc.Store(id="download-user-data")
     ])
 
 
@@ -666,12 +781,13 @@ def user_status_page():
      Input('user-status-dropdown', 'value')],
 )
 def update_user_chart(selected_state, selected_status):
+    state = data_state
     # Filter users based on the state dropdown
-    filtered_users = user_data.copy()
+    filtered_users = state.user_data.copy()
 
     if selected_state:
         # Filter users by the selected state from the pre-merged data
-        state_user_ids = appointment[appointment['state'] == selected_state]['user_id']
+        state_user_ids = state.appointment[state.appointment['state'] == selected_state]['user_id']
         filtered_users = filtered_users[filtered_users['user_id'].isin(state_user_ids)]
 
     # Filter by user status
@@ -690,75 +806,38 @@ def update_user_chart(selected_state, selected_status):
         title="User Distribution by Status",
         labels={'status': 'User Status', 'count': 'User Count'}
     )
-from joblib import Parallel, delayed
-import multiprocessing
+# User statuses are classified relative to the load date
+@downloads.export('user-data', 'detailed_user_data', version=lambda: today.date().isoformat())
+def user_data_export(selected_state, selected_status, columns=None):
+    state = data_state
+    # Apply filters directly on appointment to reduce data size early
+    filtered_appointments = state.appointment
+
+    if selected_state:
+        filtered_appointments = filtered_appointments[filtered_appointments['state'] == selected_state]
+
+    if selected_status != 'All':
+        user_ids = state.user_data[state.user_data['status'] == selected_status]['user_id']
+        filtered_appointments = filtered_appointments[filtered_appointments['user_id'].isin(user_ids)]
+
+    # One row per user, grouped in a single pass
+    return user_export(filtered_appointments, columns=columns)
+
 @app.callback(
     Output("download-user-data", "data"),
     [Input('export-button', 'n_clicks'),
      Input('state-dropdown', 'value'),
-     Input('user-status-dropdown', 'value')]
+     Input('user-status-dropdown', 'value')],
+    [State('export-button-format', 'value'),
+     State('export-button-columns', 'value')]
 )
-def export_user_data(n_clicks, selected_state, selected_status):
+def export_user_data(n_clicks, selected_state, selected_status, export_format, export_columns):
     if n_clicks > 0:
-        # Apply filters directly on appointment to reduce data size early
-        filtered_appointments = appointment.copy()
-
-        if selected_state:
-            filtered_appointments = filtered_appointments[filtered_appointments['state'] == selected_state]
-
-        if selected_status != 'All':
-            user_ids = user_data[user_data['status'] == selected_status]['user_id']
-            filtered_appointments = filtered_appointments[filtered_appointments['user_id'].isin(user_ids)]
-
-        # Group data by user_id
-        grouped_appointments = filtered_appointments.groupby('user_id')
-
-        # Parallel processing for detailed export data
-        # Updated function to process user data
-        def process_user_data(user_id, group):
-            # Count different user statuses
-            status_counts = group['status'].value_counts().to_dict()
-            count_p = status_counts.get('P', 0)  # Potential
-            count_c = status_counts.get('C', 0)  # Confirmed
-            count_l = status_counts.get('L', 0)  # Lost
-            count_all = group['status'].nunique()  # Unique statuses in the group
-
-            # Count unique g_ids
-            unique_g_ids = len(group['g_id'].unique())
-
-            return {
-                'user_id': user_id,
-                'g_ids': ', '.join(group['g_id'].unique().astype(str)),
-                'unique_g_ids': unique_g_ids,  # New column
-                'total_appointments': group['appointment_id'].count(),
-                'appointment_dates': ', '.join(group['appointment_date'].dt.strftime('%Y-%m-%d %H:%M')),
-                'Appointment_status': ', '.join(group['status']),
-                'count_P': count_p,  # New column
-                'count_C': count_c,  # New column
-                'count_L': count_l,  # New column
-                'count_All_Statuses': count_all,  # New column
-                'status': group['status'].iloc[0] if 'status' in group.columns else 'Unknown',
-                'state': group['state'].iloc[0] if 'state' in group.columns else 'Unknown',
-                'total_final_sum': group['total_final'].sum()
-            }
+        # Only a one-time URL goes through the callback; the browser fetches
+        # the file from the streaming route
+        return downloads.url('user-data', selected_state, selected_status, fmt=export_format, columns=export_columns)
 
-
-        # Determine number of available CPU cores
-        num_cores = multiprocessing.cpu_count()
-
-        detailed_data = Parallel(n_jobs=num_cores)(
-            delayed(process_user_data)(user_id, group) for user_id, group in grouped_appointments
-        )
-
-        # Create a DataFrame from parallel results
-        export_df = pd.DataFrame(detailed_data)
-
-        # Create a downloadable CSV
-        return dcc.send_data_frame(
-            export_df.to_csv,
-            filename="detailed_user_data.csv",
-            index=False
-        )
+open_downloads(app, 'download-user-data')
 
 # ----------------- Page 3: Total Final Summary -----------------
 
@@ -770,8 +849,8 @@ def total_final_summary_page():
         html.Label("Filter Appointments by Date:"),
         dcc.DatePickerRange(
             id='date-picker-range',
-            start_date=appointment['appointment_date'].min().date(),
-            end_date=appointment['appointment_date'].max().date(),
+            start_date=data_state.appointment['appointment_date'].min().date(),
+            end_date=data_state.appointment['appointment_date'].max().date(),
             display_format='YYYY-MM-DD',
             style={'margin-bottom': '20px'}
         ),
@@ -786,28 +865,23 @@ def total_final_summary_page():
     [Input('date-picker-range', 'start_date'),
      Input('date-picker-range', 'end_date')]
 )
+@callback_cache.memoize('total-final-summary', key=date_range_key)
 def update_home_content(start_date, end_date):
-    start_date = pd.to_datetime(start_date).tz_localize('UTC')
-    end_date = pd.to_datetime(end_date).tz_localize('UTC')
-    filtered_data = appointment[
-        (appointment['appointment_date'] >= start_date) &
-        (appointment['appointment_date'] <= end_date)
-    ]
+    summary = summarize_range(to_utc(start_date), to_utc(end_date))
 
     total_final_summary_data = []
 
     # G_ID Summary Table
-    g_id_summary = filtered_data.groupby(['g_id', 'state']).agg(
-        Revenue=('total_final', 'sum'),
-        Appointment_Count=('appointment_id', 'size')
-    ).reset_index()
+    g_id_summary = summary['g_id_summary']
     total_final_summary_data.append(html.Div([
         html.H4("G_ID Summary", style={'textAlign': 'center'}),
+        export_options('export-table-g-id-summary', g_id_summary.columns),
         html.Button('Export G_ID Summary', id='export-table-g-id-summary', n_clicks=0),
-        dcc.Download(id="download-table-g-id-summary"),
+        dcc.Store(id="download-table-g-id-summary"),
         dash.dash_table.DataTable(
+            id='table-g-id-summary',
             columns=[{"name": col, "id": col} for col in g_id_summary.columns],
-            data=g_id_summary.to_dict('records'),
+            **paged_table_props(g_id_summary),
             style_table={'overflowX': 'auto'},
             style_cell={
                 'textAlign': 'center',  # Center align all text
@@ -841,18 +915,16 @@ def update_home_content(start_date, end_date):
     ], style={'marginBottom': '30px'}))
 
     # G_ID Complaints Table
-    filtered_data['if_complain'] = filtered_data['if_complain'].map({'Yes': 1, 'No': 0})
-        
-        # Filter for complaints (where 'if_complain' is 1)
-    complaints_data = filtered_data[filtered_data['if_complain'] == 1]
-    g_id_complaints = complaints_data.groupby(['g_id', 'state']).size().reset_index(name='Complaints')
+    g_id_complaints = summary['g_id_complaints']
     total_final_summary_data.append(html.Div([
         html.H4("G_ID Complaints", style={'textAlign': 'center'}),
+        export_options('export-table-g-id-complaints', g_id_complaints.columns),
         html.Button('Export G_ID Complaints', id='export-table-g-id-complaints', n_clicks=0),
-        dcc.Download(id="download-table-g-id-complaints"),
+        dcc.Store(id="download-table-g-id-complaints"),
         dash.dash_table.DataTable(
+            id='table-g-id-complaints',
             columns=[{"name": col, "id": col} for col in g_id_complaints.columns],
-            data=g_id_complaints.to_dict('records'),
+            **paged_table_props(g_id_complaints),
             style_table={'overflowX': 'auto'},
             style_cell={
                 'textAlign': 'center',  # Center align all text
@@ -886,15 +958,16 @@ def update_home_content(start_date, end_date):
     ], style={'marginBottom': '30px'}))
 
     # User State Count Table
-    user_state_count = filtered_data.groupby('state')['user_id'].nunique().reset_index()
-    user_state_count.columns = ['State', 'User Count']
+    user_state_count = summary['user_state_count']
     total_final_summary_data.append(html.Div([
         html.H4("User State Count", style={'textAlign': 'center'}),
+        export_options('export-table-user-state-count', user_state_count.columns),
         html.Button('Export User State Count', id='export-table-user-state-count', n_clicks=0),
-        dcc.Download(id="download-table-user-state-count"),
+        dcc.Store(id="download-table-user-state-count"),
         dash.dash_table.DataTable(
+            id='table-user-state-count',
             columns=[{"name": col, "id": col} for col in user_state_count.columns],
-            data=user_state_count.to_dict('records'),
+            **paged_table_props(user_state_count),
             style_table={'overflowX': 'auto'},
             style_cell={
                 'textAlign': 'center',  # Center align all text
@@ -930,74 +1003,65 @@ def update_home_content(start_date, end_date):
     return [html.Div(total_final_summary_data)]
 
 
-@app.callback(
-    Output("download-table-g-id-summary", "data"),
-    [Input("export-table-g-id-summary", "n_clicks"),
-     Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date')]
-)
-def export_table_g_id_summary(n_clicks, start_date, end_date):
-    if n_clicks > 0:
-        start_date = pd.to_datetime(start_date)
-        end_date = pd.to_datetime(end_date)
-        filtered_data = appointment[
-            (appointment['appointment_date'] >= start_date) &
-            (appointment['appointment_date'] <= end_date)
-        ]
-        g_id_summary = filtered_data.groupby(['g_id', 'state']).agg(
-            Revenue=('total_final', 'sum'),
-            Appointment_Count=('appointment_id', 'size')
-        ).reset_index()
-        return dcc.send_data_frame(g_id_summary.to_csv, filename="g_id_summary_table.csv", index=False)
+# Table exports are streamed from /downloads like the user data export, in
+# the format and with the columns picked next to each export button
+TABLE_EXPORTS = {
+    'g-id-summary': 'g_id_summary',
+    'g-id-complaints': 'g_id_complaints',
+    'user-state-count': 'user_state_count',
+}
 
+def register_table_export(name, frame_name):
+    @downloads.export(name, f'{frame_name}_table')
+    def table_export(start_date, end_date, columns=None):
+        return summarize_range(to_utc(start_date), to_utc(end_date))[frame_name]
+
+    @app.callback(
+        Output(f'download-table-{name}', 'data'),
+        [Input(f'export-table-{name}', 'n_clicks'),
+         Input('date-picker-range', 'start_date'),
+         Input('date-picker-range', 'end_date')],
+        [State(f'export-table-{name}-format', 'value'),
+         State(f'export-table-{name}-columns', 'value')]
+    )
+    def export_table(n_clicks, start_date, end_date, export_format, export_columns):
+        if n_clicks > 0:
+            return downloads.url(name, start_date, end_date, fmt=export_format, columns=export_columns)
 
-@app.callback(
-    Output("download-table-g-id-complaints", "data"),
-    [Input("export-table-g-id-complaints", "n_clicks"),
-     Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date')]
-)
-def export_table_g_id_complaints(n_clicks, start_date, end_date):
-    if n_clicks > 0:
-        start_date = pd.to_datetime(start_date)
-        end_date = pd.to_datetime(end_date)
-        
-        # Filter appointments within the date range
-        filtered_data = appointment[
-            (appointment['appointment_date'] >= start_date) &
-            (appointment['appointment_date'] <= end_date)
-        ]
-        
-        # Map 'Yes' to 1 and 'No' to 0 in the 'if_complain' column
-        filtered_data['if_complain'] = filtered_data['if_complain'].map({'Yes': 1, 'No': 0})
-        
-        # Filter for complaints (where 'if_complain' is 1)
-        complaints_data = filtered_data[filtered_data['if_complain'] == 1]
-        
-        # Group by 'g_id' and 'state', then count complaints
-        g_id_complaints = complaints_data.groupby(['g_id', 'state']).size().reset_index(name='Complaints')
-        
-        # Return CSV for download
-        return dcc.send_data_frame(g_id_complaints.to_csv, filename="g_id_complaints_table.csv", index=False)
+for name, frame_name in TABLE_EXPORTS.items():
+    register_table_export(name, frame_name)
 
+open_downloads(app, *[f'download-table-{name}' for name in TABLE_EXPORTS])
 
-@app.callback(
-    Output("download-table-user-state-count", "data"),
-    [Input("export-table-user-state-count", "n_clicks"),
-     Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date')]
-)
-def export_table_user_state_count(n_clicks, start_date, end_date):
-    if n_clicks > 0:
-        start_date = pd.to_datetime(start_date)
-        end_date = pd.to_datetime(end_date)
-        filtered_data = appointment[
-            (appointment['appointment_date'] >= start_date) &
-            (appointment['appointment_date'] <= end_date)
-        ]
-        user_state_count = filtered_data.groupby('state')['user_id'].nunique().reset_index()
-        user_state_count.columns = ['State', 'User Count']
-        return dcc.send_data_frame(user_state_count.to_csv, filename="user_state_count_table.csv", index=False)
+
+# The summary tables hold one page at a time; paging, sorting and filtering
+# are applied here to the range's cached summary frames
+PAGED_TABLES = {
+    'table-g-id-summary': 'g_id_summary',
+    'table-g-id-complaints': 'g_id_complaints',
+    'table-user-state-count': 'user_state_count',
+}
+
+def register_table_paging(table_id, name):
+    @app.callback(
+        [Output(table_id, 'data'),
+         Output(table_id, 'page_count')],
+        [Input(table_id, 'page_current'),
+         Input(table_id, 'page_size'),
+         Input(table_id, 'sort_by'),
+         Input(table_id, 'filter_query')],
+        [State('date-picker-range', 'start_date'),
+         State('date-picker-range', 'end_date')],
+        # The summary callback renders the first page itself
+        prevent_initial_call=True
+    )
+    def update_table_page(page_current, page_size, sort_by, filter_query, start_date, end_date):
+        frame = summarize_range(to_utc(start_date), to_utc(end_date))[name]
+        data, page_count = table_page(frame, page_current, page_size, sort_by, filter_query)
+        return data, page_count
+
+for table_id, name in PAGED_TABLES.items():
+    register_table_paging(table_id, name)
 
 # ----------------- Page 4: Appointment Analysis -----------------
 def appointment_analysis_page():
@@ -1008,8 +1072,8 @@ def appointment_analysis_page():
         html.Label("Filter Appointments by Date:"),
         dcc.DatePickerRange(
             id='appointment-date-picker',
-            start_date=appointment['appointment_date'].min().date(),
-            end_date=appointment['appointment_date'].max().date(),
+            start_date=data_state.appointment['appointment_date'].min().date(),
+            end_date=data_state.appointment['appointment_date'].max().date(),
             display_format='YYYY-MM-DD',
             style={'margin-bottom': '20px'}
         ),
@@ -1025,13 +1089,15 @@ def appointment_analysis_page():
     Input('appointment-date-picker', 'start_date'),
     Input('appointment-date-picker', 'end_date')
 )
+@callback_cache.memoize('appointment-analysis', key=date_range_key)
 def update_appointment_graphs(start_date, end_date):
     start_date = pd.to_datetime(start_date).tz_localize('UTC')
     end_date = pd.to_datetime(end_date).tz_localize('UTC')
-    filtered_data = appointment[
-        (appointment['appointment_date'] >= start_date) &
-        (appointment['appointment_date'] <= end_date)
-    ]
+    state = data_state
+    if state.appointment_dates is not None:
+        filtered_data = state.appointment_dates.between(start_date, end_date)
+    else:
+        filtered_data = state.appointment[state.appointment['appointment_date'].between(start_date, end_date)]
     histogram_fig = px.histogram(
         filtered_data,
         x='appointment_date',
@@ -1056,7 +1122,7 @@ def update_appointment_graphs(start_date, end_date):
 
 
 # ----------------- Page 4: Registration Analysis -----------------
-user['registered_date'] = pd.to_datetime(appointment['cdate'], format='%d-%m-%Y %H:%M', dayfirst=True)
+user['registered_date'] = appointment['appointment_date']
 appointment = appointment.merge(user[['user_id', 'registered_date']], on='user_id', how='left')
 
 appointment['days_to_appointment'] = (appointment['appointment_date'] - appointment['registered_date']).dt.days
@@ -1065,15 +1131,35 @@ appointment = appointment[appointment['days_to_appointment'].notnull() & (appoin
 appointment['appointment_index'] = appointment.groupby('user_id').cumcount() + 1
 appointment = appointment.sort_values(by=['user_id', 'appointment_date'])
 appointment['days_between_appointments'] = appointment.groupby('user_id')['appointment_date'].diff().dt.days
-appointment_gap_summary = (
-    appointment
-    .groupby('appointment_index')
-    .agg(
-        avg_days_between_appointments=('days_between_appointments', 'mean'),
-        appointment_count=('appointment_id', 'count')
+
+# Gap sums and counts per appointment_index; a refresh adjusts them by the
+# rows of the users it touches. Gaps are whole days, so the sums are exact.
+def gap_totals(rows):
+    return rows.groupby('appointment_index').agg(
+        days_sum=('days_between_appointments', 'sum'),
+        days_count=('days_between_appointments', 'count'),
+        appointment_count=('appointment_id', 'count'),
     )
-    .reset_index()
-)
+
+def gap_summary(totals):
+    return pd.DataFrame({
+        'appointment_index': totals.index.to_numpy(),
+        'avg_days_between_appointments': (totals['days_sum'] / totals['days_count']).where(totals['days_count'] > 0).to_numpy(),
+        'appointment_count': totals['appointment_count'].to_numpy(dtype='int64'),
+    })
+
+appointment_gaps = gap_totals(appointment)
+appointment_gap_summary = gap_summary(appointment_gaps)
+
+if QUERY_MODE == 'sql':
+    appointment_dates = daily_cube = user_sketches = None
+else:
+    # Date-picker callbacks slice this date-sorted view instead of masking every row
+    appointment_dates = DateIndex(appointment)
+    appointment = appointment_dates.frame
+    # Daily prefix sums behind the in-memory date-range cube
+    daily_cube = DailyCube(appointment_dates)
+    user_sketches = DailySketches(appointment_dates) if COUNT_MODE == 'approximate' else None
 
 def registrations():
     return html.Div([
@@ -1085,7 +1171,7 @@ def registrations():
         id='quarter-dropdown',
         options=[
             {'label': str(quarter), 'value': str(quarter)}
-            for quarter in appointment['registered_date'].dt.to_period('Q').unique()
+            for quarter in data_state.appointment['registered_date'].dt.to_period('Q').unique()
         ],
         value=None,
         placeholder="Select a Quarter"
@@ -1112,12 +1198,14 @@ def registrations():
     ],
     [Input('quarter-dropdown', 'value')]
 )
+@callback_cache.memoize('registration')
 def update_all_figures(selected_quarter):
+    state = data_state
     # Filter data based on selected quarter
     filtered_data = (
-        appointment[appointment['registered_date'].dt.to_period('Q') == selected_quarter]
+        state.appointment[state.appointment['registered_date'].dt.to_period('Q') == selected_quarter]
         if selected_quarter
-        else appointment
+        else state.appointment
     )
 
     # Create histogram
@@ -1146,7 +1234,7 @@ def update_all_figures(selected_quarter):
 
     # Create line chart for gaps between appointments
     gap_fig = px.line(
-        appointment_gap_summary,
+        state.appointment_gap_summary,
         x='appointment_index',
         y='avg_days_between_appointments',
         title='Average Days Between Consecutive Appointments',
@@ -1178,6 +1266,179 @@ def display_page(pathname):
     else:
         return home_page()
 
+# ----------------- Incremental Refresh -----------------
+# New zip_appointment rows are pulled in by watermark (appointment_id) every
+# REFRESH_INTERVAL seconds (0 disables it). Only the new rows go through the
+# load steps above, and they are folded into the date indexes, cubes,
+# sketches and gap totals rather than those being rebuilt from every row.
+# Everything a refresh replaces lives in one immutable DataState, together
+# with its version and key. A callback reads `data_state` once and uses only
+# that, and a refresh builds the next state off to the side and publishes it
+# with a single assignment, so a request never mixes two datasets. The
+# caches read the version from the state as well; a callback reads the state
+# after its cache lookup, so its data is never older than its cache key.
+REFRESH_INTERVAL = float(os.getenv('REFRESH_INTERVAL', '300'))
+refresh_lock = threading.Lock()
+
+DataState = namedtuple('DataState', [
+    'appointment', 'appointment_dates', 'daily_cube', 'user_sketches',
+    'user_last_appointment', 'user_data',
+    'merged_data', 'heatmap_dates', 'heatmap_cube',
+    'appointment_gaps', 'appointment_gap_summary',
+    # `version` counts refreshes; `key` identifies the rows across
+    # restarts and workers (see data_key)
+    'version', 'key',
+])
+
+def data_key():
+    # Identity of the loaded rows that also holds across restarts and
+    # workers, for the on-disk caches. It is computed from the rows
+    # themselves, so a process that loads tables changed by UPDATE or
+    # DELETE gets a new key, not another process's files
+    digests = [table_digests[table] for table in sorted(table_digests)]
+    return hashlib.blake2b(json.dumps(digests).encode(), digest_size=8).hexdigest()
+
+data_state = DataState(
+    appointment=appointment,
+    appointment_dates=appointment_dates,
+    daily_cube=daily_cube,
+    user_sketches=user_sketches,
+    user_last_appointment=user_last_appointment,
+    user_data=user_data,
+    merged_data=merged_data,
+    heatmap_dates=heatmap_dates,
+    heatmap_cube=heatmap_cube,
+    appointment_gaps=appointment_gaps,
+    appointment_gap_summary=appointment_gap_summary,
+    version=0,
+    key=data_key(),
+)
+# Only data_state holds these from here on, so a refresh frees them
+del appointment, appointment_dates, daily_cube, user_sketches, user_last_appointment, user_data
+del merged_data, heatmap_dates, heatmap_cube, appointment_gaps, appointment_gap_summary
+
+def enrich_appointments(rows):
+    # Same enrichment as in Load Data and Home Page
+    rows = rows.fillna({
+        col: 0 for col in rows.columns
+        if not isinstance(rows[col].dtype, pd.CategoricalDtype)
+    })
+    rows = pd.merge(rows, address, on='user_id', how='left')
+    rows = pd.merge(rows, user[['user_id', 'email']], on='user_id', how='left')
+    rows['email'] = rows['email'].fillna('No Email')
+    rows = pd.merge(rows, address_mapped[['user_id', 'state']], on='user_id', how='left')
+    rows['state'] = rows['state_y']
+    return rows.drop(columns=['state_x', 'state_y'])
+
+def register_appointments(rows, current):
+    # Registration Analysis columns, continuing each user's existing history.
+    # Returns `current` with the new rows appended, and the rows of the
+    # affected users before and after the update (for the gap totals)
+    rows = rows.merge(user[['user_id', 'registered_date']], on='user_id', how='left')
+    rows['days_to_appointment'] = (rows['appointment_date'] - rows['registered_date']).dt.days
+    rows = rows[rows['days_to_appointment'].notnull() & (rows['days_to_appointment'] >= 0)].copy()
+
+    counts = current.loc[current['user_id'].isin(rows['user_id']), 'user_id'].value_counts()
+    rows['appointment_index'] = (
+        rows['user_id'].map(counts).fillna(0).astype(int)
+        + rows.groupby('user_id').cumcount() + 1
+    )
+    combined = append_rows(current, rows.sort_values(by=['user_id', 'appointment_date']))
+
+    # A new appointment may predate ones already loaded, so the gaps are
+    # recomputed over the whole history of the affected users
+    affected = combined[combined['user_id'].isin(rows['user_id'])].sort_values(by=['user_id', 'appointment_date'])
+    before = affected[affected.index < len(current)]
+    combined.loc[affected.index, 'days_between_appointments'] = (
+        affected.groupby('user_id')['appointment_date'].diff().dt.days
+    )
+    return combined, before, combined.loc[affected.index]
+
+def classify_users(rows, current):
+    # Re-classify only the users with new appointments
+    latest = pd.concat([
+        current[current['user_id'].isin(rows['user_id'])][['user_id', 'appointment_date']],
+        rows[['user_id', 'appointment_date']].assign(
+            appointment_date=rows['appointment_date'].dt.tz_convert(None)
+        ),
+    ]).groupby('user_id')['appointment_date'].max().reset_index()
+    latest['days_since_last_appointment'] = (today - latest['appointment_date']).dt.days
+    latest['status'] = latest['days_since_last_appointment'].apply(classify_user)
+    return latest
+
+def apply_new_appointments(rows):
+    global data_state
+    with refresh_lock:
+        state = data_state
+        enriched = enrich_appointments(rows)
+        combined, before, after = register_appointments(enriched, state.appointment)
+        added = combined.iloc[len(state.appointment):]
+        if state.appointment_dates is not None:
+            appointment_dates = state.appointment_dates.extended(combined)
+            appointment = appointment_dates.frame
+            daily_cube = state.daily_cube.extended(appointment_dates, added)
+            user_sketches = state.user_sketches.extended(appointment_dates, added) if state.user_sketches is not None else None
+        else:
+            appointment_dates = daily_cube = user_sketches = None
+            appointment = combined
+
+        latest = classify_users(rows, state.user_last_appointment)
+        affected = latest['user_id']
+        user_last_appointment = pd.concat([
+            state.user_last_appointment[~state.user_last_appointment['user_id'].isin(affected)], latest
+        ], ignore_index=True)
+        user_data = pd.concat([
+            state.user_data[~state.user_data['user_id'].isin(affected)],
+            pd.merge(latest, user[['user_id', 'email']], on='user_id', how='left'),
+        ], ignore_index=True)
+
+        if state.heatmap_dates is not None:
+            heatmap_rows = append_rows(
+                state.merged_data,
+                pd.merge(rows[['user_id', 'g_id', 'total_final', 'appointment_date']], users, on='user_id', how='left'),
+            )
+            heatmap_dates = state.heatmap_dates.extended(heatmap_rows)
+            heatmap_cube = state.heatmap_cube.extended(heatmap_dates, heatmap_rows.iloc[len(state.merged_data):])
+            merged_data = heatmap_dates.frame
+        else:
+            heatmap_dates = heatmap_cube = merged_data = None
+        appointment_gaps = state.appointment_gaps.add(gap_totals(after), fill_value=0).sub(gap_totals(before), fill_value=0)
+
+        # The same key a fresh load of these rows would get
+        table_digests['zip_appointment'] = (table_digests['zip_appointment'] + table_digest(rows)) % (1 << 64)
+        data_state = DataState(
+            appointment=appointment,
+            appointment_dates=appointment_dates,
+            daily_cube=daily_cube,
+            user_sketches=user_sketches,
+            user_last_appointment=user_last_appointment,
+            user_data=user_data,
+            merged_data=merged_data,
+            heatmap_dates=heatmap_dates,
+            heatmap_cube=heatmap_cube,
+            appointment_gaps=appointment_gaps,
+            appointment_gap_summary=gap_summary(appointment_gaps),
+            version=state.version + 1,
+            key=data_key(),
+        )
+
+refresher = WatermarkRefresher(
+    load_new_appointments, apply_new_appointments, 'appointment_id', appointment_watermark, REFRESH_INTERVAL
+)
+
 # ----------------- Run the App -----------------
+def start_refresher():
+    if REFRESH_INTERVAL > 0:
+        refresher.start()
+
+def create_server():
+    # WSGI entry point, e.g. `gunicorn -w 4 'db_app:create_server()'`. Each
+    # worker holds its own copy of the data, so each starts its own
+    # refresher, here, after the fork. Not with --preload: the factory
+    # would then run in the master, and its thread isn't forked.
+    start_refresher()
+    return server
+
 if __name__ == '__main__':
+    start_refresher()
     app.run_server(debug=True)
\ No newline at end of file
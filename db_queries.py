@@ -0,0 +1,287 @@
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from schemas import CATEGORY, arrow_to_frame
+
+
+def database_url():
+    # Same DB_* settings (.env) as db_app.py, for the command-line tools
+    load_dotenv()
+    return (
+        f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+        f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    )
+
+
+# ----------------- Projected Table Queries -----------------
+# Columns each zip_* table is loaded with: (source column, select expression,
+# result column). Keys are cast and timestamps parsed by Postgres, so only
+# the needed columns cross the wire and pandas gets them ready to use.
+CDATE_FORMAT = 'DD-MM-YYYY HH24:MI'
+
+TABLE_COLUMNS = {
+    'zip_appointment': [
+        ('appointment_id', 'appointment_id', 'appointment_id'),
+        ('user_id', 'user_id::text', 'user_id'),
+        ('g_id', 'g_id::text', 'g_id'),
+        ('status', 'status', 'status'),
+        ('total_final', 'total_final::float8', 'total_final'),
+        ('if_complain', 'if_complain', 'if_complain'),
+        # appointment_ts (timestamptz, see migrations.py) when the table has
+        # it, otherwise cdate converted according to how it is stored
+        ('appointment_ts', 'appointment_ts', 'appointment_date'),
+        ('cdate', None, 'appointment_date'),
+    ],
+    'zip_user': [
+        ('user_id', 'user_id::text', 'user_id'),
+        ('email', 'email', 'email'),
+        ('zip', 'zip::text', 'zip'),
+    ],
+    'zip_address': [
+        ('user_id', 'user_id::text', 'user_id'),
+        ('state', 'state', 'state'),
+    ],
+    'zip_address_mapped': [
+        ('user_id', 'user_id::text', 'user_id'),
+        ('state', 'state', 'state'),
+        ('zip', 'zip::text', 'zip'),
+        ('latitude', 'latitude::float4', 'latitude'),
+        ('longitude', 'longitude::float4', 'longitude'),
+    ],
+}
+
+# Compact pandas dtypes applied to the query results
+TABLE_DTYPES = {
+    'zip_appointment': {'status': 'category'},
+    'zip_address': {'state': 'category'},
+    'zip_address_mapped': {'state': 'category', 'latitude': 'float32', 'longitude': 'float32'},
+}
+
+# Arrow types the COPY fast path decodes each result column into
+TABLE_ARROW_TYPES = {
+    'zip_appointment': {
+        'appointment_id': pa.int64(),
+        'user_id': pa.string(),
+        'g_id': pa.string(),
+        'status': CATEGORY,
+        'total_final': pa.float64(),
+        'if_complain': pa.string(),
+        'appointment_date': pa.timestamp('ns', tz='UTC'),
+    },
+    'zip_user': {'user_id': pa.string(), 'email': pa.string(), 'zip': pa.string()},
+    'zip_address': {'user_id': pa.string(), 'state': CATEGORY},
+    'zip_address_mapped': {
+        'user_id': pa.string(),
+        'state': CATEGORY,
+        'zip': pa.string(),
+        'latitude': pa.float32(),
+        'longitude': pa.float32(),
+    },
+}
+
+
+def appointment_date_sql(cdate_type, column='cdate'):
+    # Always an instant in UTC, whether cdate holds 'dd-mm-YYYY HH:MM' text or
+    # a timestamp column
+    if cdate_type == 'timestamp with time zone':
+        return column
+    if cdate_type == 'timestamp without time zone':
+        return f"{column} AT TIME ZONE 'UTC'"
+    return f"to_timestamp({column}, '{CDATE_FORMAT}')::timestamp AT TIME ZONE 'UTC'"
+
+
+def appointment_ts_sql(column_types, alias):
+    # The indexed appointment_ts column when present, so range predicates on
+    # it can use an index scan; cdate converted on the fly otherwise
+    if 'appointment_ts' in column_types:
+        return f'{alias}.appointment_ts'
+    return appointment_date_sql(column_types.get('cdate'), f'{alias}.cdate')
+
+
+def table_column_types(conn, table):
+    rows = conn.execute(
+        text(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = :table"
+        ),
+        {'table': table},
+    )
+    return dict(rows.fetchall())
+
+
+def projected_query(conn, table):
+    # Optional columns (e.g. 'email') are skipped when the table lacks them
+    column_types = table_column_types(conn, table)
+    expressions = []
+    results = set()
+    for source, expression, result in TABLE_COLUMNS[table]:
+        if source not in column_types or result in results:
+            continue
+        if source == 'cdate':
+            expression = appointment_date_sql(column_types[source])
+        expressions.append(expression if expression == result else f'{expression} AS {result}')
+        results.add(result)
+    return f"SELECT {', '.join(expressions)} FROM {table}"
+
+
+def rows_after_query(conn, table, column):
+    # Same projection, limited to the rows past a watermark on `column`
+    return f"{projected_query(conn, table)} WHERE {column} > :watermark ORDER BY {column}"
+
+
+# ----------------- Date-Range Aggregates -----------------
+# Used by the SQL pushdown mode: Postgres filters zip_appointment to the
+# picked range and groups it, and only the aggregated rows come back.
+def ranged_appointments_sql(column_types):
+    appointment_date = appointment_ts_sql(column_types, 'a')
+    return f"""
+        WITH ranged AS (
+            SELECT a.appointment_id,
+                   a.user_id::text AS user_id,
+                   a.g_id::text AS g_id,
+                   a.status,
+                   a.total_final::float8 AS total_final,
+                   (a.if_complain = 'Yes')::int AS complaint,
+                   {appointment_date} AS appointment_date,
+                   m.state,
+                   m.zip::text AS zip
+            FROM zip_appointment a
+            -- The in-memory frame is merged with zip_address too; joining it
+            -- keeps the row multiplicity the same. Its state is superseded
+            -- by the mapped one there as well.
+            LEFT JOIN zip_address d ON d.user_id::text = a.user_id::text
+            LEFT JOIN zip_address_mapped m ON m.user_id::text = a.user_id::text
+            WHERE {appointment_date} >= :start AND {appointment_date} <= :end
+        )
+    """
+
+
+RANGE_QUERIES = {
+    # Appointment count and revenue for every g_id x state x status x complaint
+    'cube': """
+        SELECT g_id, state, status, complaint,
+               count(*) AS appointments, sum(total_final) AS revenue
+        FROM ranged
+        GROUP BY g_id, state, status, complaint
+    """,
+    'totals': """
+        SELECT count(DISTINCT appointment_id) AS total_appointments,
+               count(DISTINCT user_id) AS total_users,
+               min(appointment_date) AS first_date,
+               max(appointment_date) AS last_date
+        FROM ranged
+    """,
+    'state_users': """
+        SELECT state, count(DISTINCT user_id) AS users
+        FROM ranged
+        WHERE state IS NOT NULL
+        GROUP BY state
+        ORDER BY state COLLATE "C"
+    """,
+    'zip_users': """
+        SELECT zip, array_agg(DISTINCT user_id) AS user_id, array_agg(DISTINCT g_id) AS g_id
+        FROM ranged
+        WHERE zip IS NOT NULL
+        GROUP BY zip
+        ORDER BY zip COLLATE "C"
+    """,
+}
+
+
+def range_aggregates(conn, column_types, start_date, end_date):
+    ranged = ranged_appointments_sql(column_types)
+    params = {'start': start_date.to_pydatetime(), 'end': end_date.to_pydatetime()}
+    aggregates = {
+        name: pd.read_sql(text(ranged + query), conn, params=params)
+        for name, query in RANGE_QUERIES.items()
+    }
+    totals = aggregates['totals'].iloc[0].to_dict()
+    # An empty range has no dates: NaT, like the in-memory summary, rather
+    # than None
+    for column in ('first_date', 'last_date'):
+        totals[column] = pd.NaT if pd.isna(totals[column]) else pd.to_datetime(totals[column], utc=True)
+    aggregates['totals'] = totals
+    return aggregates
+
+
+# Appointments per zip_user ZIP x g_id in the range, for the home heatmap
+def range_heatmap(conn, column_types, start_date, end_date):
+    appointment_date = appointment_ts_sql(column_types, 'a')
+    query = f"""
+        SELECT u.zip::text AS zip, a.g_id::text AS g_id, count(*) AS appointments
+        FROM zip_appointment a
+        LEFT JOIN zip_user u ON u.user_id::text = a.user_id::text
+        WHERE {appointment_date} >= :start AND {appointment_date} <= :end
+        GROUP BY 1, 2
+    """
+    params = {'start': start_date.to_pydatetime(), 'end': end_date.to_pydatetime()}
+    return pd.read_sql(text(query), conn, params=params)
+
+
+# ----------------- COPY Fetch -----------------
+# Streams a query result with COPY ... TO STDOUT instead of fetching Python
+# row tuples. psycopg2 writes the CSV into a pipe from a worker thread while
+# Arrow parses it block by block into typed columns, so peak memory stays
+# close to the size of the finished frame.
+COPY_BLOCK_SIZE = int(os.getenv('COPY_BLOCK_SIZE', 8 * 1024 * 1024))
+
+
+def inline_params(query, params):
+    # COPY can't take bind parameters, so render them as SQL literals
+    statement = text(query).bindparams(**params)
+    return str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+
+
+def copy_query(engine, query, column_types, params=None, block_size=COPY_BLOCK_SIZE):
+    if params:
+        query = inline_params(query, params)
+    copy_sql = f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)"
+
+    read_fd, write_fd = os.pipe()
+    errors = []
+    connection = engine.raw_connection()
+
+    def produce():
+        try:
+            with os.fdopen(write_fd, 'wb') as sink:
+                cursor = connection.cursor()
+                # Timestamps come out as '...+00'; SET LOCAL ends with the transaction
+                cursor.execute("SET LOCAL TIME ZONE 'UTC'")
+                cursor.copy_expert(copy_sql, sink)
+        except Exception as error:
+            errors.append(error)
+
+    writer = threading.Thread(target=produce, name='copy-writer', daemon=True)
+    writer.start()
+    try:
+        with os.fdopen(read_fd, 'rb') as source:
+            reader = pv.open_csv(
+                source,
+                read_options=pv.ReadOptions(block_size=block_size),
+                convert_options=pv.ConvertOptions(
+                    column_types=column_types,
+                    # NULL is written unquoted, an empty string as ""
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=False,
+                ),
+            )
+            table = reader.read_all()
+    except Exception:
+        # Closing the pipe stops the writer; its error explains the failure better
+        writer.join()
+        if errors:
+            raise errors[0]
+        raise
+    finally:
+        writer.join()
+        connection.close()
+    if errors:
+        raise errors[0]
+    return arrow_to_frame(table)
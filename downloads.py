@@ -0,0 +1,244 @@
+import os
+import secrets
+import threading
+import time
+import zlib
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dash import dcc, html, Input
+from flask import Response, abort, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+# Rows rendered per CSV chunk of a streamed export
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '20000'))
+# Seconds a download URL stays valid
+DOWNLOAD_TTL = int(os.getenv('DOWNLOAD_TTL', '300'))
+# Compress downloads on the fly for browsers that accept gzip
+EXPORT_GZIP = os.getenv('EXPORT_GZIP', '1') == '1'
+
+# zstd level of Parquet exports: close to gzip -9 sizes, still fast to write
+PARQUET_ZSTD_LEVEL = 9
+
+# Export file formats: label, file extension and content type
+EXPORT_FORMATS = {
+    'csv': ('CSV', '.csv', 'text/csv'),
+    'csv.gz': ('gzip CSV', '.csv.gz', 'application/gzip'),
+    'parquet': ('Parquet', '.parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def csv_chunks(frame, chunk_rows=EXPORT_CHUNK_ROWS):
+    # The frame as CSV text, header first, chunk_rows rows at a time
+    yield frame.iloc[:0].to_csv(index=False)
+    for start in range(0, len(frame), chunk_rows):
+        yield frame.iloc[start:start + chunk_rows].to_csv(index=False, header=False)
+
+
+def gzip_chunks(chunks):
+    # One gzip stream over the text chunks, compressed as they come
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def gunzip_chunks(chunks):
+    # The text bytes of a gzip stream, decompressed as it comes
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def _arrow_table(frame):
+    try:
+        return pa.Table.from_pandas(frame, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Object columns mixing strings with other values are written as text
+        frame = frame.copy()
+        for column in frame.columns[frame.dtypes == object]:
+            frame[column] = frame[column].map(lambda value: value if isinstance(value, str) or pd.isna(value) else str(value))
+        return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+class _Sink:
+    # File the Parquet writer writes to; the bytes written so far are taken
+    # out after each row group while tell() keeps counting for the footer
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_chunks(frame, chunk_rows=EXPORT_CHUNK_ROWS):
+    # The frame as a zstd-compressed Parquet file, one row group of
+    # chunk_rows rows at a time
+    table = _arrow_table(frame)
+    sink = _Sink()
+    with pq.ParquetWriter(sink, table.schema, compression='zstd', compression_level=PARQUET_ZSTD_LEVEL) as writer:
+        for start in range(0, max(table.num_rows, 1), chunk_rows):
+            writer.write_table(table.slice(start, chunk_rows), row_group_size=chunk_rows)
+            yield sink.take()
+    yield sink.take()
+
+
+def export_options(button_id, columns):
+    # Format picker and column chooser for an export button; its callback
+    # reads them as State(f'{button_id}-format', 'value') and
+    # State(f'{button_id}-columns', 'value')
+    return html.Div([
+        dcc.Dropdown(
+            id=f'{button_id}-format',
+            options=[{'label': label, 'value': value} for value, (label, _, _) in EXPORT_FORMATS.items()],
+            value='csv',
+            clearable=False,
+            style={'width': '150px'}
+        ),
+        dcc.Dropdown(
+            id=f'{button_id}-columns',
+            options=[{'label': column, 'value': column} for column in columns],
+            value=[],
+            multi=True,
+            placeholder="All columns",
+            style={'flex': '1'}
+        ),
+    ], style={'display': 'flex', 'gap': '10px', 'margin': '10px 0'})
+
+
+# Opening a download URL saves the file without leaving the page
+OPEN_DOWNLOAD = """
+function(url) {
+    if (url) {
+        window.location.assign(url);
+    }
+}
+"""
+
+
+def open_downloads(app, *store_ids):
+    # The browser opens every URL written to these dcc.Stores
+    for store_id in store_ids:
+        app.clientside_callback(OPEN_DOWNLOAD, Input(store_id, 'data'), prevent_initial_call=True)
+
+
+# ----------------- Streaming Downloads -----------------
+# Exports don't travel through the callback response. The callback returns
+# a signed, expiring, one-time URL naming the export and its arguments; the
+# /downloads route builds the export and streams it in row chunks as CSV,
+# gzip CSV or Parquet, with only the chosen columns.
+# The signature makes the URL valid on any worker and across restarts, so
+# DOWNLOAD_SECRET is required outside the (single-process) debug server.
+# The one-time check is per process: on several workers a URL can be used
+# once per worker, and only the TTL bounds reuse. With an
+# ExportCache, generated files are kept on disk and repeat downloads are
+# streamed from there; CSV is kept gzipped and decompressed only for
+# browsers that don't accept gzip.
+class StreamingDownloads:
+    def __init__(self, server, secret=os.getenv('DOWNLOAD_SECRET'), ttl=DOWNLOAD_TTL, compress=EXPORT_GZIP, cache=None, debug=False):
+        if not secret:
+            if not debug:
+                raise RuntimeError("DOWNLOAD_SECRET is not set; download URLs must verify on every worker and after restarts")
+            # The debug server is a single process, so a random key will do
+            secret = secrets.token_hex(32)
+        self._serializer = URLSafeTimedSerializer(secret, salt='downloads')
+        self.ttl = ttl
+        self.compress = compress
+        self.cache = cache
+        self._exports = {}
+        self._used = {}
+        self._lock = threading.Lock()
+        server.add_url_rule('/downloads/<token>', 'download', self._download)
+
+    def export(self, name, filename, version=None):
+        # Registers func(*args, columns=None) -> DataFrame as the export
+        # `name`; `columns` is the chosen subset (None for all), which func
+        # may use to skip work. filename has no extension. `version` returns
+        # anything else the result depends on besides the dataset, for the
+        # cache key.
+        def decorator(func):
+            self._exports[name] = (func, filename, version)
+            return func
+        return decorator
+
+    def url(self, name, *args, fmt='csv', columns=None):
+        # Download URL for export `name` built with args (JSON-serializable)
+        # in format fmt, restricted to columns when given
+        return '/downloads/' + self._serializer.dumps([name, list(args), fmt, list(columns or []), secrets.token_hex(8)])
+
+    def _claim(self, nonce):
+        # Used nonces are only known to this process
+        now = time.time()
+        with self._lock:
+            self._used = {used: expiry for used, expiry in self._used.items() if expiry > now}
+            if nonce in self._used:
+                return False
+            self._used[nonce] = now + self.ttl
+            return True
+
+    def _download(self, token):
+        try:
+            name, args, fmt, columns, nonce = self._serializer.loads(token, max_age=self.ttl)
+        except BadSignature:
+            abort(404)
+        if name not in self._exports or fmt not in EXPORT_FORMATS or not self._claim(nonce):
+            abort(404)
+        func, filename, version = self._exports[name]
+        _, extension, mimetype = EXPORT_FORMATS[fmt]
+        headers = {'Content-Disposition': f'attachment; filename="{filename}{extension}"'}
+
+        # CSV goes out gzipped when the browser accepts it, and is always
+        # cached gzipped
+        accepts_gzip = self.compress and 'gzip' in request.accept_encodings
+        gzipped_csv = fmt == 'csv' and (accepts_gzip or self.cache is not None)
+        stored_fmt = 'csv.gz' if gzipped_csv else fmt
+        key = [name, args, stored_fmt, columns, version() if version else None]
+
+        body = self.cache.read(key) if self.cache is not None else None
+        if body is None:
+            # Built before the response starts, so a failure is an error
+            # status rather than a truncated file
+            frame = func(*args, columns=columns or None)
+            if columns:
+                frame = frame[[column for column in frame.columns if column in columns] or frame.columns]
+            if stored_fmt == 'parquet':
+                body = parquet_chunks(frame)
+            elif stored_fmt == 'csv.gz':
+                body = gzip_chunks(csv_chunks(frame))
+            else:
+                body = (chunk.encode('utf-8') for chunk in csv_chunks(frame))
+            if self.cache is not None:
+                body = self.cache.write_through(key, body)
+
+        if gzipped_csv:
+            if accepts_gzip:
+                headers['Content-Encoding'] = 'gzip'
+            else:
+                body = gunzip_chunks(body)
+        return Response(body, mimetype=mimetype, headers=headers)
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import secrets
+
+# Directory and size budget (MiB) of the export file cache; 0 disables it
+EXPORT_CACHE_DIR = os.getenv('EXPORT_CACHE_DIR', '.export-cache')
+EXPORT_CACHE_MB = float(os.getenv('EXPORT_CACHE_MB', '1024'))
+
+# Bytes read per chunk when streaming a cached file
+READ_CHUNK_BYTES = 1 << 20
+
+
+# ----------------- Export Cache -----------------
+# Generated export files kept on local disk, named by a hash of (export
+# name, filter values, format, columns, dataset version), so repeated
+# downloads are streamed from disk instead of rebuilt. The version is part
+# of the key: files of an older dataset are never hit again and age out.
+# Files are evicted least recently used first (by mtime, touched on every
+# hit) once the directory holds more than max_bytes. Everything is in the
+# directory itself, so workers on one host and later restarts share it.
+class ExportCache:
+    def __init__(self, version, directory=EXPORT_CACHE_DIR, max_bytes=int(EXPORT_CACHE_MB * 1024 * 1024)):
+        self.version = version
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.blake2b(json.dumps([key, self.version()], default=str).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def read(self, key):
+        # Chunks of the cached file for key, or None on a miss. The file is
+        # opened right away, so a concurrent eviction can't cut it short.
+        path = self._path(key)
+        try:
+            handle = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return self._chunks(handle)
+
+    def _chunks(self, handle):
+        with handle:
+            for chunk in iter(lambda: handle.read(READ_CHUNK_BYTES), b''):
+                yield chunk
+
+    def write_through(self, key, chunks):
+        # Passes the chunks on while writing them to a temporary file, which
+        # becomes the cached file once the last chunk is through. An
+        # interrupted download leaves nothing behind. Caching is best effort:
+        # if the file can't be written, the download goes on uncached.
+        path = self._path(key)
+        tmp_path = f'{path}.{secrets.token_hex(4)}.tmp'
+        try:
+            handle = open(tmp_path, 'wb')
+        except OSError:
+            handle = None
+        try:
+            for chunk in chunks:
+                if handle is not None:
+                    try:
+                        handle.write(chunk)
+                    except OSError:
+                        handle.close()
+                        handle = None
+                yield chunk
+            if handle is not None:
+                handle.close()
+                handle = None
+                os.replace(tmp_path, path)
+        finally:
+            if handle is not None:
+                handle.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'version': self.version(),
+        }
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+# Appointment statuses counted per user: Potential, Confirmed, Lost
+STATUS_CODES = ['P', 'C', 'L']
+
+
+def _starts(codes):
+    # Positions where each run of equal (sorted) codes begins
+    if not len(codes):
+        return np.empty(0, dtype='int64')
+    return np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+
+def _joined(values, starts):
+    # ', '-joined values of each run
+    if not len(starts):
+        return []
+    return [', '.join(chunk) for chunk in np.split(np.asarray(values, dtype=object), starts[1:])]
+
+
+# ----------------- User Export -----------------
+def user_export_columns(first_columns=('status', 'state'), status_counts=True):
+    # Columns of user_export, in order
+    return (
+        ['user_id', 'g_ids']
+        + (['unique_g_ids'] if status_counts else [])
+        + ['total_appointments', 'appointment_dates', 'Appointment_status']
+        + ([f'count_{code}' for code in STATUS_CODES] + ['count_All_Statuses'] if status_counts else [])
+        + list(first_columns)
+        + ['total_final_sum']
+    )
+
+
+# One row per user_id for the detailed user export, built with array
+# operations over the appointment rows sorted by user instead of a Python
+# function per user. The sort is stable, so joined values keep the rows'
+# order and each user's first row is the start of its run. Only the
+# requested columns (all by default) are built.
+def user_export(appointments, first_columns=('status', 'state'), status_counts=True, columns=None):
+    names = user_export_columns(first_columns, status_counts)
+    wanted = [name for name in names if not columns or name in columns] or names
+
+    rows = appointments[appointments['user_id'].notna()]
+    codes, users = pd.factorize(rows['user_id'], sort=True)
+    order = np.argsort(codes, kind='stable')
+    rows, codes = rows.iloc[order], codes[order]
+    starts = _starts(codes)
+    n_users = len(users)
+    export = {'user_id': users}
+
+    if 'g_ids' in wanted or 'unique_g_ids' in wanted:
+        # Distinct g_ids per user, in order of first appearance
+        g_ids = pd.DataFrame({'code': codes, 'g_id': rows['g_id'].to_numpy()}).drop_duplicates()
+        export['g_ids'] = _joined(g_ids['g_id'].astype(str), _starts(g_ids['code'].to_numpy()))
+        export['unique_g_ids'] = np.bincount(g_ids['code'], minlength=n_users)
+    if 'total_appointments' in wanted:
+        export['total_appointments'] = np.bincount(codes[rows['appointment_id'].notna().to_numpy()], minlength=n_users)
+    if 'appointment_dates' in wanted:
+        export['appointment_dates'] = _joined(rows['appointment_date'].dt.strftime('%Y-%m-%d %H:%M'), starts)
+
+    status = rows['status'].astype(str).to_numpy()
+    if 'Appointment_status' in wanted:
+        export['Appointment_status'] = _joined(status, starts)
+    for code in STATUS_CODES:
+        if f'count_{code}' in wanted:
+            export[f'count_{code}'] = np.bincount(codes[status == code], minlength=n_users)
+    if 'count_All_Statuses' in wanted:
+        statuses = pd.DataFrame({'code': codes, 'status': rows['status'].to_numpy()}).dropna().drop_duplicates()
+        export['count_All_Statuses'] = np.bincount(statuses['code'], minlength=n_users)
+
+    for column in first_columns:
+        export[column] = rows[column].to_numpy()[starts] if column in rows.columns else 'Unknown'
+    if 'total_final_sum' in wanted:
+        # One reduction per user, like Series.sum, so totals match to the last digit
+        total_final = rows['total_final'].fillna(0).to_numpy(dtype='float64')
+        export['total_final_sum'] = [chunk.sum() for chunk in np.split(total_final, starts[1:])] if n_users else []
+    return pd.DataFrame({name: export[name] for name in wanted}, index=pd.RangeIndex(n_users))
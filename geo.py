@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+
+STATE_NAMES = {
+    "AL": "Alabama",
+    "AR": "Arkansas",
+    "AZ": "Arizona",
+    "NY": "New York",
+    "CA": "California",
+    "CO": "Colorado",
+    "CT": "Connecticut",
+    "DC": "District of Columbia",
+    "DE": "Delaware",
+    "FL": "Florida",
+    "GA": "Georgia",
+    "HI": "Hawaii",
+    "IL": "Illinois",
+    "IN": "Indiana",
+    "KY": "Kentucky",
+    "LA": "Louisiana",
+    "MA": "Massachusetts",
+    "MD": "Maryland",
+    "ME": "Maine",
+    "MI": "Michigan",
+    "MN": "Minnesota",
+    "MO": "Missouri",
+    "MS": "Mississippi",
+    "MT": "Montana",
+    "NC": "North Carolina",
+    "NE": "Nebraska",
+    "NJ": "New Jersey",
+    "NH": "New Hampshire",
+    "NV": "Nevada",
+    "OH": "Ohio",
+    "OK": "Oklahoma",
+    "PA": "Pennsylvania",
+    "SC": "South Carolina",
+    "TX": "Texas",
+    "TN": "Tennessee",
+    "UT": "Utah",
+    "VA": "Virginia",
+    "WA": "Washington",
+    "WY": "Wyoming",
+}
+
+POPUP_TEMPLATE = """
+                        ZIP: {zip}
+                        State: {state_name}
+                        User ID Count: {user_id_count}
+                        user ids:{user_ids}
+                        g_ids:{g_ids}
+                        """
+
+
+# ----------------- ZIP Index -----------------
+# Everything the G_ID distribution map needs to know about a ZIP (mean
+# coordinates, state and state name), built once from address_mapped when
+# the data loads. Callers treat it as read-only.
+class ZipIndex:
+    def __init__(self, address_mapped):
+        coordinates = address_mapped.groupby('zip')[['latitude', 'longitude']].mean().dropna()
+        # The state of a ZIP is the one on its first address_mapped row
+        states = address_mapped.drop_duplicates('zip').set_index('zip')['state']
+        states = states.reindex(coordinates.index).astype(object)
+        self.zips = coordinates.assign(
+            state=states,
+            state_name=states.map(STATE_NAMES).fillna('Unknown State'),
+        )
+        # Distinct (user_id, zip) pairs, to place appointments without
+        # re-merging the whole address_mapped frame
+        self.user_zips = address_mapped[['user_id', 'zip']].dropna().drop_duplicates(ignore_index=True)
+
+    def zip_users(self, rows):
+        # (zip, user_id, g_id) for the appointment rows of users with a ZIP
+        return rows[['user_id', 'g_id']].drop_duplicates().merge(self.user_zips, on='user_id')
+
+    def points(self, zip_users):
+        # Map points for the ZIPs (with coordinates) in zip_users: either
+        # (zip, user_id, g_id) rows or one row per ZIP holding lists of
+        # user_ids and g_ids
+        if len(zip_users) and isinstance(zip_users['user_id'].iloc[0], (list, tuple, np.ndarray)):
+            zip_users = pd.concat([
+                zip_users[['zip', 'user_id']].explode('user_id'),
+                zip_users[['zip', 'g_id']].explode('g_id'),
+            ], ignore_index=True)
+        zips = pd.Index(zip_users['zip'].dropna().unique()).sort_values()
+        zips = zips[zips.isin(self.zips.index)]
+        pairs = zip_users.loc[zip_users['zip'].isin(zips), ['zip', 'user_id', 'g_id']]
+
+        user_id_count = pairs[['zip', 'user_id']].dropna().drop_duplicates().groupby('zip').size()
+        places = self.zips.loc[zips].assign(user_id_count=user_id_count.reindex(zips, fill_value=0))
+        return MapPoints(places, pairs)
+
+
+# ----------------- Viewport Clustering -----------------
+# The map layer only receives the points inside the current viewport,
+# clustered on a Web Mercator pixel grid for the current zoom, so the
+# payload depends on what is on screen rather than on the number of ZIPs.
+CLUSTER_PIXELS = 64
+# From this zoom on every ZIP is shown on its own
+MAX_CLUSTER_ZOOM = 12
+
+
+def mercator(latitude, longitude):
+    # Position on the Web Mercator world square, both in [0, 1]
+    latitude = np.radians(np.clip(latitude, -85.0511, 85.0511))
+    x = (np.asarray(longitude, dtype='float64') + 180) / 360
+    y = (1 - np.log(np.tan(latitude) + 1 / np.cos(latitude)) / np.pi) / 2
+    return x, y
+
+
+def _feature(latitude, longitude, properties):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+        'properties': properties,
+    }
+
+
+class MapPoints:
+    # The ZIP points of one date range, sorted by x so a viewport's
+    # longitude span is two binary searches. The range's (zip, user_id, g_id)
+    # rows are kept sorted by ZIP, so a popup's details are looked up only
+    # when it is opened.
+    def __init__(self, places, pairs):
+        latitude = places['latitude'].to_numpy(dtype='float64')
+        longitude = places['longitude'].to_numpy(dtype='float64')
+        x, y = mercator(latitude, longitude)
+        order = np.argsort(x, kind='stable')
+        self.zips = places.index.to_numpy()[order].tolist()
+        self.latitude = latitude[order]
+        self.longitude = longitude[order]
+        self.x = x[order]
+        self.y = y[order]
+        self.user_id_count = places['user_id_count'].to_numpy()[order]
+        self.state_names = places['state_name'].to_dict()
+        self._pairs = pairs.sort_values('zip', kind='stable', ignore_index=True)
+        self._pair_zips = self._pairs['zip'].to_numpy()
+
+    def __len__(self):
+        return len(self.zips)
+
+    def _visible(self, bounds):
+        # Positions of the points inside [[south, west], [north, east]],
+        # padded by a quarter of the view so edge clusters are stable
+        if not bounds:
+            return np.arange(len(self))
+        (south, west), (north, east) = bounds
+        pad_lat, pad_lon = (north - south) / 4, (east - west) / 4
+        south, north, west, east = south - pad_lat, north + pad_lat, west - pad_lon, east + pad_lon
+        if east - west >= 360:
+            positions = np.arange(len(self))
+        else:
+            # Longitudes past +-180 come from panning across the antimeridian
+            west = (west + 180) % 360 - 180
+            east = (east + 180) % 360 - 180
+            lo = np.searchsorted(self.x, mercator(0, west)[0], side='left')
+            hi = np.searchsorted(self.x, mercator(0, east)[0], side='right')
+            positions = np.arange(lo, hi) if west <= east else np.r_[np.arange(lo, len(self)), np.arange(0, hi)]
+        inside = (self.latitude[positions] >= south) & (self.latitude[positions] <= north)
+        return positions[inside]
+
+    def popup(self, zip_code):
+        # Popup text for one ZIP: its distinct user_ids and g_ids in the range
+        if zip_code not in self.state_names:
+            return None
+        lo = np.searchsorted(self._pair_zips, zip_code, side='left')
+        hi = np.searchsorted(self._pair_zips, zip_code, side='right')
+        rows = self._pairs.iloc[lo:hi]
+        distinct_user_ids = sorted(rows['user_id'].dropna().unique())
+        distinct_g_ids = sorted(rows['g_id'].dropna().unique())
+        user_id_count = len(distinct_user_ids)
+        if user_id_count == 0:
+            user_ids = "No User_IDs available"
+            g_ids = "No G_IDs available"
+        else:
+            user_ids = f"{user_id_count} User_ID(s): {', '.join(map(str, distinct_user_ids))}"
+            g_ids = f"G_ID(s): {', '.join(map(str, distinct_g_ids))}"
+        return POPUP_TEMPLATE.format(
+            zip=zip_code, state_name=self.state_names[zip_code], user_id_count=user_id_count,
+            user_ids=user_ids, g_ids=g_ids,
+        )
+
+    def features(self, bounds=None, zoom=4):
+        # GeoJSON FeatureCollection for a viewport: single ZIPs and clusters
+        # carry counts only; popups are fetched on click
+        positions = self._visible(bounds)
+        zoom = int(round(zoom if zoom is not None else 4))
+        if zoom >= MAX_CLUSTER_ZOOM or not len(positions):
+            cells = np.arange(len(positions))
+        else:
+            cells_per_side = (256 << max(zoom, 0)) // CLUSTER_PIXELS
+            cell_x = np.floor(self.x[positions] * cells_per_side).astype('int64')
+            cell_y = np.floor(self.y[positions] * cells_per_side).astype('int64')
+            cells = cell_x * cells_per_side + cell_y
+        _, group, size = np.unique(cells, return_inverse=True, return_counts=True)
+
+        latitude = np.bincount(group, self.latitude[positions]) / size
+        longitude = np.bincount(group, self.longitude[positions]) / size
+        users = np.bincount(group, self.user_id_count[positions])
+        first = np.full(len(size), len(positions))
+        np.minimum.at(first, group, np.arange(len(positions)))
+        # Extent of each cluster, for zooming in on a click
+        south, west = np.full(len(size), np.inf), np.full(len(size), np.inf)
+        north, east = np.full(len(size), -np.inf), np.full(len(size), -np.inf)
+        np.minimum.at(south, group, self.latitude[positions])
+        np.minimum.at(west, group, self.longitude[positions])
+        np.maximum.at(north, group, self.latitude[positions])
+        np.maximum.at(east, group, self.longitude[positions])
+
+        features = []
+        for count, lat, lon, user_count, position, extent in zip(
+            size.tolist(), latitude.tolist(), longitude.tolist(), users.tolist(), positions[first].tolist(),
+            np.column_stack([south, west, north, east]).tolist(),
+        ):
+            if count == 1:
+                zip_code = self.zips[position]
+                features.append(_feature(
+                    float(self.latitude[position]), float(self.longitude[position]),
+                    {'zip': zip_code, 'user_id_count': int(user_count), 'tooltip': f"ZIP {zip_code}: {int(user_count)} users"},
+                ))
+            else:
+                features.append(_feature(lat, lon, {
+                    'cluster': True,
+                    'point_count': count,
+                    'bounds': [extent[:2], extent[2:]],
+                    'tooltip': f"{count} ZIPs, {int(user_count)} users",
+                }))
+        return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,206 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+
+from db_queries import CDATE_FORMAT, appointment_date_sql, database_url
+from migrations import add_appointment_ts
+
+# ----------------- Ingest Targets -----------------
+# CSV export -> zip_* table. 'columns' is only used to create a missing
+# table; an existing table keeps its own column types, and only the CSV
+# columns it has are loaded. Rows are upserted on 'key'; tables without a
+# natural key (a user can have several addresses) are reloaded whole from
+# the export instead, and their schema is left alone.
+TABLES = {
+    'zip_appointment': {
+        'source': 'appointment_list.csv',
+        'key': 'appointment_id',
+        'columns': {
+            'appointment_id': 'bigint',
+            'user_id': 'bigint',
+            'g_id': 'bigint',
+            'status': 'text',
+            'total_final': 'double precision',
+            'if_complain': 'text',
+            'cdate': 'text',
+            'appointment_ts': 'timestamptz',  # filled from cdate by a trigger
+        },
+    },
+    'zip_user': {
+        'source': 'user.csv',
+        'key': 'user_id',
+        'columns': {'user_id': 'bigint', 'email': 'text', 'zip': 'text'},
+    },
+    'zip_address': {
+        'source': 'address.csv',
+        'key': None,
+        'columns': {'user_id': 'bigint', 'state': 'text'},
+    },
+    'zip_address_mapped': {
+        'source': 'address_mapped.csv',
+        'key': None,
+        'columns': {
+            'user_id': 'bigint',
+            'state': 'text',
+            'zip': 'text',
+            'latitude': 'double precision',
+            'longitude': 'double precision',
+        },
+    },
+}
+
+# Secondary indexes for the dashboard's per-ZIP lookups. The primary keys
+# cover the upserts and the refresh watermark, and the appointment_ts
+# migration indexes zip_appointment.
+INDEXES = {
+    'zip_user': [('zip',)],
+    'zip_address_mapped': [('zip',)],
+}
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+# ----------------- Table Setup -----------------
+def ensure_table(cursor, table, spec):
+    columns = [f'{quote(name)} {kind}' for name, kind in spec['columns'].items()]
+    if spec['key'] is not None:
+        columns.append(f"PRIMARY KEY ({quote(spec['key'])})")
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {quote(table)} ({', '.join(columns)})")
+    if spec['key'] is None:
+        return
+
+    # Tables created elsewhere (e.g. by to_sql) have no key to upsert on
+    cursor.execute(
+        "SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'",
+        (quote(table),),
+    )
+    if cursor.fetchone() is None:
+        cursor.execute(f"ALTER TABLE {quote(table)} ADD PRIMARY KEY ({quote(spec['key'])})")
+
+
+def table_types(cursor, table):
+    cursor.execute(
+        "SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped ORDER BY attnum",
+        (quote(table),),
+    )
+    return dict(cursor.fetchall())
+
+
+def create_indexes(cursor, table):
+    for columns in INDEXES.get(table, []):
+        name = quote(f"{table}_{'_'.join(columns)}_idx")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {quote(table)} ({', '.join(map(quote, columns))})")
+
+
+# ----------------- Bulk Load -----------------
+def cast_sql(column, kind):
+    # Staged text as the target column's type. Dates in the exports are
+    # 'dd-mm-YYYY HH:MM', parsed with that format (as UTC, like the dashboard
+    # reads cdate) rather than by the server's DateStyle
+    if kind.startswith('timestamp') and kind.endswith(' with time zone'):
+        return appointment_date_sql('text', quote(column))
+    if kind.startswith('timestamp') or kind == 'date':
+        return f"to_timestamp({quote(column)}, '{CDATE_FORMAT}')::{kind}"
+    return f'{quote(column)}::{kind}'
+
+
+def upsert_sql(table, key, columns, types):
+    # Rows are COPY'd into an all-text staging table first. DISTINCT ON keeps
+    # the last line for a repeated key, since ON CONFLICT can't touch the same
+    # row twice in one statement. Without a key every staged row is inserted.
+    casts = ', '.join(f'{cast_sql(column, types[column])} AS {quote(column)}' for column in columns)
+    if key is None:
+        return f"INSERT INTO {quote(table)} ({', '.join(map(quote, columns))}) SELECT {casts} FROM ingest_stage"
+    updates = ', '.join(f'{quote(column)} = EXCLUDED.{quote(column)}' for column in columns if column != key)
+    on_conflict = f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'
+    return (
+        f"INSERT INTO {quote(table)} ({', '.join(map(quote, columns))}) "
+        f"SELECT DISTINCT ON ({quote(key)}) {casts} FROM ingest_stage "
+        f"ORDER BY {quote(key)}, ctid DESC "
+        f"ON CONFLICT ({quote(key)}) {on_conflict}"
+    )
+
+
+def ingest_table(engine, table, path, indexes=True):
+    spec = TABLES[table]
+    started = time.perf_counter()
+    with open(path, newline='') as handle:
+        header = next(csv.reader(handle))
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        ensure_table(cursor, table, spec)
+        if table == 'zip_appointment':
+            # The cdate -> appointment_ts trigger has to exist before the upsert
+            add_appointment_ts(cursor)
+        types = table_types(cursor, table)
+        columns = [column for column in header if column in types]
+        if spec['key'] is not None and spec['key'] not in columns:
+            raise ValueError(f"{path} has no '{spec['key']}' column")
+
+        staged = ', '.join(f'{quote(column)} text' for column in header)
+        cursor.execute(f"CREATE TEMP TABLE ingest_stage ({staged}) ON COMMIT DROP")
+        with open(path, 'rb') as source:
+            cursor.copy_expert("COPY ingest_stage FROM STDIN WITH (FORMAT csv, HEADER true)", source)
+        if spec['key'] is None:
+            # A full reload: DELETE rather than TRUNCATE, so readers keep
+            # seeing the old rows until the transaction commits
+            cursor.execute(f"DELETE FROM {quote(table)}")
+        cursor.execute(upsert_sql(table, spec['key'], columns, types))
+        rows = cursor.rowcount
+        if indexes:
+            create_indexes(cursor, table)
+        # Fresh statistics so the planner picks up the new indexes
+        cursor.execute(f"ANALYZE {quote(table)}")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return rows, time.perf_counter() - started
+
+
+def ingest(engine, data_dir, tables, indexes=True, workers=None):
+    # One connection and transaction per table, all tables in parallel
+    with ThreadPoolExecutor(max_workers=workers or len(tables)) as executor:
+        futures = {
+            table: executor.submit(ingest_table, engine, table, os.path.join(data_dir, TABLES[table]['source']), indexes)
+            for table in tables
+        }
+        failed = False
+        for table, future in futures.items():
+            try:
+                rows, seconds = future.result()
+            except Exception as error:
+                failed = True
+                print(f"{table}: failed: {error}")
+            else:
+                print(f"{table}: {rows} rows loaded in {seconds:.2f}s")
+    return not failed
+
+
+# ----------------- CLI -----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load the CSV exports into the zip_* tables.")
+    parser.add_argument('--data-dir', default='.', help="directory holding the CSV exports")
+    parser.add_argument('--tables', nargs='+', choices=list(TABLES), default=list(TABLES))
+    parser.add_argument('--workers', type=int, default=None, help="parallel loads (default: one per table)")
+    parser.add_argument('--no-indexes', action='store_true', help="skip creating the dashboard indexes")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(database_url(), pool_size=max(5, len(args.tables)))
+    ok = ingest(engine, args.data_dir, args.tables, indexes=not args.no_indexes, workers=args.workers)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
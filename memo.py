@@ -0,0 +1,164 @@
+import functools
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pandas as pd
+
+# Memory budget for cached callback results, in MiB
+CALLBACK_CACHE_MB = float(os.getenv('CALLBACK_CACHE_MB', '128'))
+# Live objects kept by the object cache
+OBJECT_CACHE_ENTRIES = int(os.getenv('OBJECT_CACHE_ENTRIES', '8'))
+
+
+def date_range_key(start_date, end_date, *rest):
+    # '2024-01-01' and '2024-01-01T00:00:00' are the same range
+    return (pd.to_datetime(start_date), pd.to_datetime(end_date)) + rest
+
+
+# ----------------- Callback Cache -----------------
+# LRU cache for callback results keyed by (callback name, normalized inputs,
+# dataset version). Results are stored pickled: the pickle length is what
+# counts against the budget, and every hit gets its own copy. Entries for an
+# older dataset version can never hit again, so they are dropped as soon as
+# the version changes. Concurrent misses on the same key (e.g. the home
+# page's callbacks all asking for one range's summary) wait for the first
+# computation instead of repeating it.
+class CallbackCache:
+    def __init__(self, version, max_bytes=int(CALLBACK_CACHE_MB * 1024 * 1024)):
+        self.version = version
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._seen_version = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key, version):
+        # (blob, None) on a hit, (None, future) to wait for another thread's
+        # result, (None, None) when the caller computes it
+        with self._lock:
+            if version != self._seen_version:
+                self._entries.clear()
+                self._bytes = 0
+                self._seen_version = version
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return blob, None
+            pending = self._pending.get((key, version))
+            if pending is not None:
+                self.hits += 1
+                return None, pending
+            self._pending[(key, version)] = Future()
+            self.misses += 1
+            return None, None
+
+    def _encode(self, result):
+        try:
+            return pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # Not picklable: served uncached
+            return None
+
+    def _decode(self, blob):
+        return pickle.loads(blob)
+
+    def _size(self, blob):
+        return len(blob)
+
+    def _store(self, key, version, blob):
+        # Called with the lock held
+        # The data may have been swapped while the result was computed
+        if blob is None or self._size(blob) > self.max_bytes or version != self._seen_version:
+            return
+        self._entries[key] = blob
+        self._bytes += self._size(blob)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= self._size(evicted)
+            self.evictions += 1
+
+    def _compute(self, func, args, key, version):
+        with self._lock:
+            pending = self._pending[(key, version)]
+        try:
+            result = func(*args)
+        except BaseException as error:
+            with self._lock:
+                del self._pending[(key, version)]
+            pending.set_exception(error)
+            raise
+        blob = self._encode(result)
+        with self._lock:
+            del self._pending[(key, version)]
+            self._store(key, version, blob)
+        pending.set_result((blob, result))
+        return result
+
+    def memoize(self, name, key=None):
+        # Put below @app.callback. `key` maps the callback arguments to a
+        # hashable, normalized tuple (the arguments as given by default)
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                version = self.version()
+                cache_key = (name, key(*args) if key else args)
+                blob, pending = self._lookup(cache_key, version)
+                if blob is not None:
+                    return self._decode(blob)
+                if pending is not None:
+                    blob, result = pending.result()
+                    return self._decode(blob) if blob is not None else result
+                return self._compute(func, args, cache_key, version)
+            return wrapper
+        return decorator
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'version': self._seen_version,
+            }
+
+
+# ----------------- Object Cache -----------------
+# Same LRU for results that are queried in place rather than copied, like
+# the map's MapPoints, asked for on every pan, zoom and click: unpickling a
+# large index on each hit would cost far more than the query. Entries are
+# the live objects, so a hit is free, and the budget is a number of entries
+# (sizes aren't measured). Callers must not modify what they get back.
+class ObjectCache(CallbackCache):
+    def __init__(self, version, max_entries=OBJECT_CACHE_ENTRIES):
+        super().__init__(version, max_bytes=max_entries)
+
+    def _encode(self, result):
+        return result
+
+    def _decode(self, blob):
+        return blob
+
+    def _size(self, blob):
+        return 1
+
+    def stats(self):
+        stats = super().stats()
+        del stats['bytes']
+        stats['max_entries'] = stats.pop('max_bytes')
+        return stats
@@ -0,0 +1,90 @@
+import argparse
+
+from sqlalchemy import create_engine
+
+from db_queries import appointment_date_sql, database_url
+
+# ----------------- zip_appointment.appointment_ts -----------------
+# cdate is 'dd-mm-YYYY HH:MM' text, which no range predicate can use an index
+# on. appointment_ts holds the same instant as timestamptz; a trigger keeps it
+# in step with cdate for rows written by any client, so existing writers
+# don't need to change.
+APPOINTMENT_TS_INDEXES = [
+    ('appointment_ts',),
+    ('user_id', 'appointment_ts'),
+    ('g_id', 'appointment_ts'),
+]
+
+
+def column_type(cursor, table, column):
+    cursor.execute(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s",
+        (table, column),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def add_appointment_ts(cursor):
+    cdate_type = column_type(cursor, 'zip_appointment', 'cdate')
+    cursor.execute("ALTER TABLE zip_appointment ADD COLUMN IF NOT EXISTS appointment_ts timestamptz")
+
+    if cdate_type is not None:
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION zip_appointment_set_ts() RETURNS trigger AS $$
+            BEGIN
+                NEW.appointment_ts := {appointment_date_sql(cdate_type, 'NEW.cdate')};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute("DROP TRIGGER IF EXISTS zip_appointment_set_ts ON zip_appointment")
+        cursor.execute(
+            "CREATE TRIGGER zip_appointment_set_ts BEFORE INSERT OR UPDATE OF cdate ON zip_appointment "
+            "FOR EACH ROW EXECUTE FUNCTION zip_appointment_set_ts()"
+        )
+        # Backfill the rows written before the trigger existed
+        cursor.execute(
+            f"UPDATE zip_appointment SET appointment_ts = {appointment_date_sql(cdate_type)} "
+            "WHERE appointment_ts IS NULL AND cdate IS NOT NULL"
+        )
+
+    for columns in APPOINTMENT_TS_INDEXES:
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS zip_appointment_{'_'.join(columns)}_idx "
+            f"ON zip_appointment ({', '.join(columns)})"
+        )
+    cursor.execute("ANALYZE zip_appointment")
+
+
+# Applied in order; every step is idempotent, so re-running is safe
+MIGRATIONS = [
+    add_appointment_ts,
+]
+
+
+def migrate(engine):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for migration in MIGRATIONS:
+            migration(cursor)
+            print(f"Applied {migration.__name__}")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+# ----------------- CLI -----------------
+def main(argv=None):
+    argparse.ArgumentParser(description="Apply the zip_* schema migrations.").parse_args(argv)
+    migrate(create_engine(database_url()))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
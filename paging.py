@@ -0,0 +1,94 @@
+import math
+import re
+
+import pandas as pd
+
+# Rows per page of the server-side DataTables
+PAGE_SIZE = 25
+
+# ----------------- DataTable Paging -----------------
+# DataTables with page_action/sort_action/filter_action='custom' only ever
+# hold the visible page. The aggregated frame stays on the server and each
+# page, sort or filter change asks for one page of it.
+FILTER_TERM = re.compile(
+    r"\{(?P<column>[^}]+)\}\s+(?P<operator>[si]?(?:>=|<=|!=|=|>|<|eq|ne|ge|le|gt|lt|contains|datestartswith))\s*(?P<value>.*)"
+)
+
+COMPARISONS = {
+    '=': 'eq', '!=': 'ne', '<': 'lt', '<=': 'le', '>': 'gt', '>=': 'ge',
+}
+
+
+def _filter_value(value, column):
+    # Values may be quoted with ', " or `; numeric columns compare as numbers
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in '\'"`':
+        value = value[1:-1]
+    if pd.api.types.is_numeric_dtype(column):
+        return pd.to_numeric(value, errors='coerce')
+    return value
+
+
+def filter_frame(frame, filter_query):
+    # Applies a DataTable filter_query ('{col} op value && ...'); terms that
+    # don't parse or name an unknown column are ignored
+    for term in (filter_query or '').split(' && '):
+        match = FILTER_TERM.match(term.strip())
+        if not match or match['column'] not in frame.columns:
+            continue
+        column = frame[match['column']]
+        operator = match['operator']
+        case_insensitive = operator[0] == 'i'
+        operator = COMPARISONS.get(operator.lstrip('si'), operator.lstrip('si'))
+        value = _filter_value(match['value'], column)
+
+        if operator in ('contains', 'datestartswith'):
+            text = column.astype(str)
+            if case_insensitive:
+                text, value = text.str.lower(), str(value).lower()
+            mask = text.str.contains(str(value), regex=False) if operator == 'contains' else text.str.startswith(str(value))
+        else:
+            if case_insensitive and isinstance(value, str):
+                column, value = column.astype(str).str.lower(), value.lower()
+            elif isinstance(column.dtype, pd.CategoricalDtype):
+                column = column.astype(str)
+            mask = getattr(column, operator)(value)
+        frame = frame[mask.fillna(False).to_numpy(dtype=bool)]
+    return frame
+
+
+def sort_frame(frame, sort_by):
+    sort_by = [key for key in (sort_by or []) if key['column_id'] in frame.columns]
+    if not sort_by:
+        return frame
+    return frame.sort_values(
+        [key['column_id'] for key in sort_by],
+        ascending=[key['direction'] == 'asc' for key in sort_by],
+        kind='stable',
+    )
+
+
+def table_page(frame, page_current=0, page_size=PAGE_SIZE, sort_by=None, filter_query=''):
+    # Records of the requested page and the page count after filtering
+    frame = sort_frame(filter_frame(frame, filter_query), sort_by)
+    page_count = max(math.ceil(len(frame) / page_size), 1)
+    page_current = min(page_current or 0, page_count - 1)
+    start = page_current * page_size
+    return frame.iloc[start:start + page_size].to_dict('records'), page_count
+
+
+def paged_table_props(frame, page_size=PAGE_SIZE):
+    # DataTable properties for a server-paged table showing its first page
+    data, page_count = table_page(frame, 0, page_size)
+    return {
+        'data': data,
+        'page_count': page_count,
+        'page_current': 0,
+        'page_size': page_size,
+        'page_action': 'custom',
+        'sort_action': 'custom',
+        'sort_mode': 'multi',
+        'sort_by': [],
+        'filter_action': 'custom',
+        'filter_query': '',
+    }
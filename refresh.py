@@ -0,0 +1,61 @@
+import threading
+
+import pandas as pd
+
+
+# ----------------- Watermark Refresher -----------------
+# Polls a source for the rows past the highest key seen so far (e.g. the
+# largest appointment_id) and hands each new batch to apply(). Runs on a
+# daemon thread so the dashboard keeps serving while rows are pulled in.
+class WatermarkRefresher:
+    def __init__(self, fetch, apply, column, watermark, interval):
+        self._fetch = fetch
+        self._apply = apply
+        self.column = column
+        self.watermark = watermark
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        rows = self._fetch(self.watermark)
+        if len(rows):
+            self._apply(rows)
+            self.watermark = rows[self.column].max()
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                added = self.poll()
+            except Exception as error:
+                # Keep polling; a dropped connection shouldn't end the refresher
+                print(f"Refresh failed: {error}")
+            else:
+                if added:
+                    print(f"Refresh added {added} rows (watermark {self.watermark})")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='watermark-refresher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+# ----------------- Appending Rows -----------------
+def append_rows(frame, rows):
+    # Categorical columns only survive concat when both sides share the same
+    # categories, so widen them to the (sorted) union first
+    rows = rows.copy(deep=False)
+    frame = frame.copy(deep=False)
+    for column in frame.columns[frame.dtypes == 'category']:
+        if column not in rows:
+            continue
+        categories = sorted(set(frame[column].cat.categories).union(rows[column].dropna().unique()))
+        dtype = pd.CategoricalDtype(categories)
+        frame[column] = frame[column].astype(dtype)
+        rows[column] = rows[column].astype(dtype)
+    return pd.concat([frame, rows], ignore_index=True)
@@ -0,0 +1,88 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+
+# ----------------- CSV Schemas -----------------
+# Only the columns the dashboards read are loaded, with compact types.
+# Identifiers stay strings so merges on user_id and ZIP lookups line up
+# across files; revenue stays float64 so large sums keep their cents.
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+APPOINTMENT_SCHEMA = {
+    'columns': {
+        'appointment_id': pa.int64(),
+        'user_id': pa.string(),
+        'g_id': pa.string(),
+        'status': CATEGORY,
+        'total_final': pa.float64(),
+        'if_complain': pa.string(),
+        'cdate': pa.timestamp('ns'),
+    },
+    'date_format': '%d-%m-%Y %H:%M',
+}
+
+USER_SCHEMA = {
+    'columns': {
+        'user_id': pa.string(),
+        'email': pa.string(),
+        'zip': pa.string(),
+    },
+}
+
+ADDRESS_SCHEMA = {
+    'columns': {
+        'user_id': pa.string(),
+        'state': CATEGORY,
+    },
+}
+
+ADDRESS_MAPPED_SCHEMA = {
+    'columns': {
+        'user_id': pa.string(),
+        'state': CATEGORY,
+        'zip': pa.string(),
+        'latitude': pa.float32(),
+        'longitude': pa.float32(),
+    },
+}
+
+CSV_SCHEMAS = {
+    'appointment_list.csv': APPOINTMENT_SCHEMA,
+    'user.csv': USER_SCHEMA,
+    'address.csv': ADDRESS_SCHEMA,
+    'address_mapped.csv': ADDRESS_MAPPED_SCHEMA,
+}
+
+
+# ----------------- Schema Reader -----------------
+def read_csv_schema(path, schema=None):
+    schema = schema or CSV_SCHEMAS[path]
+
+    # Optional columns (e.g. 'email') may be missing from an export, so only
+    # request the declared columns that are actually in the header
+    header = pd.read_csv(path, nrows=0).columns
+    columns = {column: kind for column, kind in schema['columns'].items() if column in header}
+
+    # pyarrow's reader parses blocks on all cores and applies the declared
+    # types (including the timestamp format) while parsing
+    table = pv.read_csv(
+        path,
+        read_options=pv.ReadOptions(use_threads=True),
+        convert_options=pv.ConvertOptions(
+            include_columns=list(columns),
+            column_types=columns,
+            strings_can_be_null=True,
+            timestamp_parsers=[schema['date_format']] if 'date_format' in schema else None,
+        ),
+    )
+    return arrow_to_frame(table)
+
+
+def arrow_to_frame(table):
+    # split_blocks/self_destruct let Arrow free each column as it is converted
+    frame = table.to_pandas(split_blocks=True, self_destruct=True)
+
+    # Keep categories sorted so groupby output stays in alphabetical order
+    for column in frame.columns[frame.dtypes == 'category']:
+        frame[column] = frame[column].cat.reorder_categories(sorted(frame[column].cat.categories))
+    return frame
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Directory holding the Arrow IPC snapshot of the merged frames
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', '.snapshot')
+MANIFEST_FILE = 'manifest.json'
+
+
+# ----------------- Source Fingerprint -----------------
+def file_digest(path, chunk_size=8 * 1024 * 1024):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_fingerprint(paths, previous=None):
+    # Size + mtime + content hash per source file. Hashing is skipped when
+    # size and mtime still match the previous manifest entry.
+    previous = previous or {}
+    fingerprint = {}
+    for path in paths:
+        stat = os.stat(path)
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        known = previous.get(path)
+        if known and known['size'] == entry['size'] and known['mtime_ns'] == entry['mtime_ns']:
+            entry['digest'] = known['digest']
+        else:
+            entry['digest'] = file_digest(path)
+        fingerprint[path] = entry
+    return fingerprint
+
+
+def fingerprint_version(fingerprint, layout=None):
+    # Stable key for the dataset, derived from the content hashes and the
+    # layout tag of the frames built from them
+    digests = {path: entry['digest'] for path, entry in fingerprint.items()}
+    if layout is not None:
+        digests = {'layout': layout, 'sources': digests}
+    return hashlib.blake2b(json.dumps(digests, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+# ----------------- Snapshot Read/Write -----------------
+def _read_manifest(snapshot_dir):
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_FILE)) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(snapshot_dir, manifest):
+    tmp_path = os.path.join(snapshot_dir, MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w') as handle:
+        json.dump(manifest, handle, indent=2)
+    os.replace(tmp_path, os.path.join(snapshot_dir, MANIFEST_FILE))
+
+
+def _normalize(frame):
+    # The frame exactly as it reads back from a snapshot: a fresh index, and
+    # object columns mixing strings with fill values (e.g. fillna(0)), which
+    # Arrow can't type, with the non-string values as text
+    frame = frame.reset_index(drop=True)
+    mixed = []
+    for column in frame.columns[frame.dtypes == object]:
+        try:
+            pa.array(frame[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            mixed.append(column)
+    if mixed:
+        frame = frame.copy()
+        for column in mixed:
+            frame[column] = frame[column].map(lambda value: value if isinstance(value, str) or pd.isna(value) else str(value))
+    return frame
+
+
+def write_snapshot(snapshot_dir, fingerprint, frames, version):
+    # Frames are written next to the live snapshot and swapped in afterwards;
+    # the manifest goes last so a half-written snapshot is never picked up.
+    # The frames are expected _normalize()d.
+    tmp_dir = snapshot_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, frame in frames.items():
+        # Uncompressed so later starts read the columns without decoding
+        feather.write_feather(pa.Table.from_pandas(frame, preserve_index=False), os.path.join(tmp_dir, f'{name}.arrow'), compression='uncompressed')
+    _write_manifest(tmp_dir, {
+        'version': version,
+        'sources': fingerprint,
+        'frames': sorted(frames),
+    })
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.replace(tmp_dir, snapshot_dir)
+
+
+def read_snapshot(snapshot_dir, names):
+    # The files are memory-mapped, so the only copy made is the pandas one
+    # (no intermediate Arrow buffers on the heap); the frames themselves are
+    # ordinary pandas memory
+    return {
+        name: feather.read_table(os.path.join(snapshot_dir, f'{name}.arrow'), memory_map=True).to_pandas()
+        for name in names
+    }
+
+
+def check_snapshot(snapshot_dir, frames):
+    # Raises AssertionError unless the snapshot loads back as exactly these
+    # frames (dtypes, categories, values and index)
+    loaded = read_snapshot(snapshot_dir, frames)
+    for name, frame in frames.items():
+        pd.testing.assert_frame_equal(loaded[name], frame, check_exact=True, obj=name)
+
+
+def load_or_build(paths, build, snapshot_dir=SNAPSHOT_DIR, layout=None):
+    # Returns (frames, dataset version). The snapshot is used when every source
+    # file still hashes to what it was built from, otherwise build() runs and
+    # its frames are written out for the next start. Changing `layout` (bump
+    # it whenever build() returns different frames or columns) also forces a
+    # rebuild.
+    manifest = _read_manifest(snapshot_dir)
+    fingerprint = source_fingerprint(paths, manifest['sources'] if manifest else None)
+    version = fingerprint_version(fingerprint, layout)
+
+    if manifest and manifest.get('version') == version:
+        try:
+            frames = read_snapshot(snapshot_dir, manifest['frames'])
+        except (OSError, pa.ArrowInvalid) as error:
+            print(f"Snapshot unreadable, rebuilding: {error}")
+        else:
+            if manifest['sources'] != fingerprint:
+                # Files were touched but not changed; remember the new mtimes
+                manifest['sources'] = fingerprint
+                _write_manifest(snapshot_dir, manifest)
+            return frames, version
+
+    # The built frames are normalized the way a snapshot load returns them,
+    # so the first start and later ones run on identical frames
+    frames = {name: _normalize(frame) for name, frame in build().items()}
+    try:
+        write_snapshot(snapshot_dir, fingerprint, frames, version)
+        check_snapshot(snapshot_dir, frames)
+    except (OSError, pa.ArrowException) as error:
+        print(f"Snapshot not written: {error}")
+    except AssertionError as error:
+        # A later start would load different frames than this one has
+        print(f"Snapshot discarded, it doesn't load back as built: {error}")
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+    return frames, version